@@ -10,23 +10,17 @@ data <- data[!is.na(data$vessel_class),]
 data <- data[!is.na(data$port_iso3),]
 
 # list of sovereign - territory pairs
-# queried from GFW on March 29, 2021
-# `world-fishing-827.gfw_research.eez_info`
-eez <- read.csv('eez_info.csv')
-eez <- eez[eez$eez_type=='200NM',]
-eez <- eez[eez$territory1_iso3 != eez$sovereign1_iso3,]
-pair <- unique(eez[, c('territory1_iso3', 'sovereign1_iso3')])
-pair <- rbind(pair, c('MAC', 'CHN'))    # add Macao to China
-pair <- rbind(pair, c('HKG', 'CHN'))    # add Hong Kong to China
+# written by iso3.py from `world-fishing-827.gfw_research.eez_info`,
+# with Macao, Hong Kong, Mayotte and Aland Islands added
+pair <- read.csv('data/territory_sovereign.csv', stringsAsFactors=FALSE, na.strings='')
+pair <- pair[!duplicated(pair$territory1_iso3, fromLast=TRUE),]
 
 
 # add sovereign nation to vessel flag and port
-data$flag_x <- data$flag
-data$port_iso3_x <-data$port_iso3
-for(i in 1:nrow(pair)) {
-  data$flag_x[data$flag==pair$territory1_iso3[i]] <- pair$sovereign1_iso3[i]
-  data$port_iso3_x[data$port_iso3==pair$territory1_iso3[i]] <- pair$sovereign1_iso3[i]
-}
+i <- match(data$flag, pair$territory1_iso3)
+data$flag_x <- ifelse(is.na(i), as.character(data$flag), pair$sovereign1_iso3[i])
+i <- match(data$port_iso3, pair$territory1_iso3)
+data$port_iso3_x <- ifelse(is.na(i), as.character(data$port_iso3), pair$sovereign1_iso3[i])
 
 
 # select visit by *foreign* vessels
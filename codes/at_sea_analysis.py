@@ -1,245 +1,336 @@
-import time
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import xgboost as xgb
-import shap
-import itertools
-import scipy
-import datatable as dt
+from shap_summary import cached_group_importance, effect_summary, importance_summary, \
+    predict_unique, unique_rows
+from model_cache import ModelCache
+from risk_model import train_model
+from chunk_pipeline import pipeline
+from id_codes import decode_columns, encode_columns, load_ids
+from query_runner import ChunkWriter
+from trip_data import iter_fishing_trips, load_fishing_trips
+from trip_store import TripStore
+from trip_features import OneHotEncoder
+from risk_score import THRESHOLD, has_risk, risk_class, risk_score
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', nargs='+', choices=['iuu', 'la'], default=['iuu'],
+        help='risk of IUU fishing (iuu) and/or labor abuse (la), run concurrently on the same trips')
+    parser.add_argument('--threshold', type=float, nargs=2, default=THRESHOLD,
+        help='risk score thresholds between risk classes 0/1 and 1/2')
+    parser.add_argument('--shap-chunk-size', type=int, default=None,
+        help='rows per SHAP interaction chunk (default: all rows at once)')
+    parser.add_argument('--shap-spill', default=None,
+        help='memory-mapped .npy file to keep raw SHAP interaction values, {target} is replaced by the target')
+    parser.add_argument('--shap-workers', type=int, default=1,
+        help='processes for SHAP interaction values (default: 1, serial)')
+    parser.add_argument('--unique-patterns', action='store_true',
+        help='predict and explain each distinct feature row once, weighting statistics by its number of trips')
+    parser.add_argument('--tree-method', default=None, choices=['exact', 'approx', 'hist'],
+        help='xgboost tree construction (default: xgboost default)')
+    parser.add_argument('--nthread', type=int, default=None,
+        help='xgboost threads per target (default: cores split between targets)')
+    parser.add_argument('--valid-fraction', type=float, default=0,
+        help='share of observed trips held out for early stopping, the model is then refit on all (default: 0, off)')
+    parser.add_argument('--early-stopping-rounds', type=int, default=10,
+        help='stop after this many rounds without improvement on the held-out trips')
+    parser.add_argument('--store', default=None,
+        help='directory of trips and scores by month; only new or changed trips are scored and '
+            'fishing_trips.csv may hold only the new months')
+    parser.add_argument('--retrain-fraction', type=float, default=0.05,
+        help='with --store, retrain when more than this share of observed trips changed (default: 0.05)')
+    parser.add_argument('--stream-chunk-size', type=int, default=None,
+        help='score and write fishing_<target> this many trips at a time, keeping only observed trips '
+            'in memory (default: all trips at once)')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv',
+        help='format of fishing_<target> with --stream-chunk-size (default: csv)')
+    parser.add_argument('--ids-dir', default='ids',
+        help='directory of the dictionaries of gfw_trip_id and ssvid codes (default: ids)')
+    parser.add_argument('--cache-dir', default=None,
+        help='directory to reuse trained models and SHAP values between runs')
+    parser.add_argument('--cache-max-gb', type=float, default=None,
+        help='remove the oldest cache entries above this size')
+    parser.add_argument('--cache-max-days', type=float, default=None,
+        help='remove cache entries unused for this many days')
+    args = parser.parse_args()
+    if args.stream_chunk_size is not None and args.store is not None:
+        parser.error('--stream-chunk-size reads fishing_trips.csv and cannot be combined with --store')
+    return args
+
+
+# observed and predicted risk of a chunk of trips, as written to fishing_<target>;
+# trips of vessel classes without observations are left out
+def score_trips(df, target, bst, encoder, classes, threshold, unique_patterns=False):
+    is_obs = np.asarray(has_risk(df, target))
+    df = df[is_obs | np.asarray(df.vessel_class.isin(classes))]
+    is_obs = np.asarray(has_risk(df, target))
+
+    out = df[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end']].copy()
+    out['risk_score'] = np.asarray(risk_score(df, target), dtype='float64')
+    out['type'] = np.where(is_obs, 'obs', 'pred')
+
+    if not is_obs.all():
+        x = encoder.transform(df.iloc[np.flatnonzero(~is_obs)])
+        if unique_patterns:
+            y = predict_unique(bst, x, encoder.feature_names)
+        else:
+            y = bst.predict(xgb.DMatrix(x, feature_names=encoder.feature_names))
+        out.loc[~is_obs, 'risk_score'] = y
+
+    out['risk_class'] = risk_class(out.risk_score, threshold)
+    return out
+
+
+# train, predict and explain the risk of one target; all and x_all are
+# shared between targets and only read here; gfw_trip_id and ssvid are
+# codes of ids. with store, the booster and the scores of unchanged trips
+# are reused
+def run_target(target, all, x_all, encoder, ids, args, cache, nthread, store=None):
+    threshold = args.threshold
+
+    # subset of data with port risk assessment
+    is_obs = np.asarray(has_risk(all, target))
+    obs = all[is_obs].copy()
+
+    # add risk score
+    obs['risk_score'] = risk_score(obs, target)
+    obs['type'] = 'obs'
+
+
+    # input for the model to predict missing port risk score
+    x_obs = x_all[np.flatnonzero(is_obs)]
+    y_obs = obs.risk_score.astype('float')
+    y_obs.reset_index(inplace=True, drop=True)
+
+
+    # fit model
+    params = {'eta':0.05, 'min_child_weight':1, 'max_depth':10, 'colsample_bytree':0.6,
+        'nthread':nthread}
+    if args.tree_method is not None:
+        params['tree_method'] = args.tree_method
+    n_trees = 100
+
+    # keep the stored booster while few observed trips changed; the store
+    # keys trips by their ids, which stay the same when the codes do not
+    retrain = True
+    if store is not None:
+        observed = pd.DataFrame({'gfw_trip_id': ids['gfw_trip_id'].decode(obs.gfw_trip_id),
+            'row_hash': obs.row_hash.to_numpy()})
+        settings = {'feature_names': encoder.feature_names, 'n_trees': n_trees,
+            'params': {k: v for k, v in params.items() if k != 'nthread'},
+            'valid_fraction': args.valid_fraction, 'early_stopping_rounds': args.early_stopping_rounds}
+        retrain = store.needs_training(target, settings, observed, args.retrain_fraction)
+
+    # reuse a booster trained on the same data and hyperparameters
+    model_key = cache.model_key(x_obs, y_obs, params, n_trees,
+        valid_fraction=args.valid_fraction, early_stopping_rounds=args.early_stopping_rounds)
+    bst = store.load_booster(target) if not retrain else cache.load_booster(model_key)
+    if bst is None:
+        bst, history, summary = train_model(params, x_obs, y_obs, n_trees, encoder.feature_names,
+            valid_fraction=args.valid_fraction, early_stopping_rounds=args.early_stopping_rounds,
+            verbose_eval=10)
+        cache.save_booster(model_key, bst)
+
+        # metrics and time of each round, and the final number of trees
+        history.to_csv('fishing_%s_train.csv' % target, index=False)
+        with open('fishing_%s_train.json' % target, 'w') as f:
+            json.dump(summary, f, indent=1)
+    if store is not None and retrain:
+        store.save_booster(target, bst, settings, observed)
+    bst.set_param({'nthread': nthread})
+
+    # model prediction of trips at positions idx of all
+    def predict(idx):
+        x = x_all[idx]
+        if args.unique_patterns:
+            return predict_unique(bst, x, encoder.feature_names)
+        return bst.predict(xgb.DMatrix(x, feature_names=encoder.feature_names))
+
+    # of every trip, kept by month in the store
+    if store is not None:
+        trips = all[['row_hash', 'partition']].assign(gfw_trip_id=ids['gfw_trip_id'].decode(all.gfw_trip_id))
+        score = store.update_scores(target, trips, predict, rescore=retrain)
+
+
+    #-----------------------------
+    # prediction error
+    #-----------------------------
+    if store is not None:
+        y_pred = score[is_obs]
+    else:
+        y_pred = predict(np.flatnonzero(is_obs))
+
+    # prediction
+    foo = obs[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end']].copy()
+    foo['risk_score'] = y_pred
+    foo['risk_class'] = risk_class(foo.risk_score, threshold)
+
+    decode_columns(foo, ids).to_csv('fishing_%s_pred.csv' % target, index=False)
+
+    # observation
+    foo = obs[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end', 'risk_score']].copy()
+    foo['risk_class'] = risk_class(foo.risk_score, threshold)
+
+    decode_columns(foo, ids).to_csv('fishing_%s_obs.csv' % target, index=False)
+
+    #-------------------
+    # predict
+    #-------------------
+    # streamed from fishing_trips.csv: chunks are read, scored and written
+    # by three threads, in the order of the file
+    if args.stream_chunk_size is not None:
+        path = 'fishing_%s.%s' % (target, args.output_format)
+        writer = ChunkWriter(path)
+        classes = obs.vessel_class.unique()
+        try:
+            pipeline(iter_fishing_trips('fishing_trips.csv', args.stream_chunk_size),
+                lambda df: score_trips(df, target, bst, encoder, classes, threshold, args.unique_patterns),
+                writer.write)
+        except BaseException:
+            writer.discard()
+            raise
+        writer.close()
+
+    else:
+        # data
+        is_pred = ~is_obs & np.asarray(all.vessel_class.isin(obs.vessel_class.unique()))
+        pred = all[is_pred].copy()
+
+        # predict
+        if store is not None:
+            pred['risk_score'] = score[is_pred]
+        else:
+            pred['risk_score'] = predict(np.flatnonzero(is_pred))
+        pred['type'] = 'pred'
+
+
+        # combine observed and predicted risk scores
+        bar = pd.concat([pred, obs])
+        bar = bar[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end', 'risk_score', 'type']]
+
+
+        # save output for gridding and plotting
+        bar['risk_class'] = risk_class(bar.risk_score, threshold)
+
+        decode_columns(bar, ids).to_csv('fishing_%s.csv' % target, index=False)
+
+
+    #-----------------------------
+    # SHAP interaction values
+    #-----------------------------
+
+    # summaries describe the model and are kept from the run that trained it
+    if not retrain:
+        return
+
+    flag_idx = encoder.group_slices['flag']
+    gear_idx = encoder.group_slices['gear']
+    tas_idx = encoder.group_slices['tas']
+
+    # with unique patterns, each distinct trip is explained once and weighted
+    # by its number of trips
+    shap_key = [model_key, 'shap']
+    if args.unique_patterns:
+        first, inverse, weights = unique_rows(x_obs)
+        x_obs = encoder.to_frame(x_obs[first])
+        shap_key.append('unique')
+    else:
+        weights = None
+        x_obs = encoder.to_frame(x_obs)
 
 
-# output of fishing_trips.sql 
-data = dt.fread('fishing_trips.csv')
+    # interaction values summed by feature group, computed over row chunks
+    # and optionally across worker processes
+    spill = None if args.shap_spill is None else args.shap_spill.format(target=target)
+    groupings = [([flag_idx, gear_idx, tas_idx], ['flag', 'gear', 'tas'])]
+    shap_importance, = cached_group_importance(cache, cache.key(*shap_key, groupings), bst, x_obs, groupings,
+        chunk_size=args.shap_chunk_size, spill=spill, workers=args.shap_workers)
 
 
-# trips with flag, gear, time at sea
-all = data.copy()
-del data
-all = all[dt.f.flag_group != '', :]
-all = all[dt.f.vessel_class != '', :]
-all = all[dt.f.time_at_sea != '', :]
+    # feature importance
 
 
-# subset of data with port risk assessment
-all = all.to_pandas()
-obs = all[all[['iuu_no_to', 'iuu_low_to', 'iuu_med_to', 'iuu_high_to']].sum(axis=1) > 0].copy()
+    # summarize
+    importance = importance_summary(shap_importance, weights)
+
+    importance.to_csv('fishing_%s_importance.csv' % target)
 
-## for labor abuse
-## obs = all[all[['la_no_to', 'la_low_to', 'la_med_to', 'la_high_to']].sum(axis=1) > 0].copy()
 
-# add risk score
-obs['risk_score'] = 1/3 * obs.iuu_low_to + 2/3 * obs.iuu_med_to + obs.iuu_high_to - obs.iuu_no_to
+    # effect of features when present
 
-## for labor abuse
-## obs['risk_score'] = 1/3 * obs.la_low_to + 2/3 * obs.la_med_to + obs.la_high_to - obs.la_no_to
+    # model baseline
+    base = np.mean(y_pred)
 
-obs['type'] = 'obs'
 
+    ## sum SHAP values over mutually exclusive features
+    ## because one is present means the others are absent
 
-# input for the model to predict missing port risk score
-x_obs = pd.get_dummies(obs[['flag_group', 'vessel_class', 'time_at_sea']])
-x_obs.reset_index(inplace=True, drop=True)
-y_obs = obs.risk_score.astype('float')
-y_obs.reset_index(inplace=True, drop=True)
-dtrain = xgb.DMatrix(data=x_obs,label=y_obs)
+    # solo features and combinations of features, summarized in one pass
+    effect = effect_summary(shap_importance, x_obs, encoder.classes, [flag_idx, gear_idx, tas_idx], base, weights)
 
+    effect.to_csv('fishing_%s_effect.csv' % target)
 
-# fit model
-params = {'eta':0.05, 'min_child_weight':1, 'max_depth':10, 'colsample_bytree':0.6}
-n_trees = 100
 
-evals_result = {}
-bst = xgb.train(params=params, dtrain=dtrain, num_boost_round=n_trees, evals=[(dtrain, 'train')],
-    verbose_eval=10, evals_result=evals_result)
+def main():
+    args = parse_args()
 
+    # one-hot layout is learned once from all trips and shared by every
+    # target for training, prediction and SHAP
+    encoder = OneHotEncoder(['flag_group', 'vessel_class', 'time_at_sea'], ['flag', 'gear', 'tas'])
 
-#-----------------------------
-# prediction error
-#-----------------------------
-x = xgb.DMatrix(x_obs)
-y_pred = bst.predict(x)
+    # output of fishing_trips.sql, trips with flag, gear, time at sea
+    if args.stream_chunk_size is None:
+        all = load_fishing_trips('fishing_trips.csv')
+        x_all = None
 
-# prediction
-foo = obs[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end']].copy()
-foo['risk_score'] = y_pred
-threshold = [0,2]
-foo['risk_class'] = [0 if x < threshold[0] else 1 if x < threshold[1] else 2 for x in foo.risk_score]
+    # in one pass, keep the trips observed for any target and the distinct
+    # feature rows for the layout; the rest is scored in run_target
+    else:
+        observed = []
+        patterns = []
+        for df in iter_fishing_trips('fishing_trips.csv', args.stream_chunk_size):
+            keep = np.any([has_risk(df, target) for target in args.targets], axis=0)
+            observed.append(df[keep])
+            patterns.append(df[encoder.columns].drop_duplicates())
+        all = pd.concat(observed, ignore_index=True).astype({x: 'category' for x in encoder.columns})
+        x_all = encoder.fit(pd.concat(patterns)).transform(all)
 
-foo.to_csv('fishing_iuu_pred.csv', index=False)
+    # the months of this export replace those in the store, and the trips
+    # of all stored months are analyzed
+    store = None
+    if args.store is not None:
+        store = TripStore(args.store)
+        all = store.update_trips(all)
 
-# for labor abuse,
-# foo.to_csv('fishing_la_pred.csv', index=False)
+    if x_all is None:
+        x_all = encoder.fit_transform(all)
 
-# observation
-foo = obs[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end', 'risk_score']].copy()
-foo['risk_class'] = [0 if x < threshold[0] else 1 if x < threshold[1] else 2 for x in foo.risk_score]
+    # trips and vessels by integer codes from here on
+    ids = load_ids(args.ids_dir)
+    encode_columns(all, ids)
+    for x in ids.values():
+        x.save()
 
-foo.to_csv('fishing_iuu_obs.csv', index=False)
+    # targets run concurrently in threads and split the cores between them
+    nthread = args.nthread
+    if nthread is None:
+        nthread = max(1, (os.cpu_count() or 1) // len(args.targets))
 
-# for labor abuse,
-# foo.to_csv('fishing_la_obs.csv', index=False)
+    cache = ModelCache(args.cache_dir,
+        max_bytes=None if args.cache_max_gb is None else args.cache_max_gb * 1e9,
+        max_age=None if args.cache_max_days is None else args.cache_max_days * 86400)
+    with ThreadPoolExecutor(max_workers=len(args.targets)) as pool:
+        jobs = [pool.submit(run_target, target, all, x_all, encoder, ids, args, cache, nthread, store)
+            for target in args.targets]
+        for job in jobs:
+            job.result()
 
-#-------------------
-# predict
-#-------------------
-# data
-pred = all.drop(obs.index)
-pred = pred[pred.vessel_class.isin(obs.vessel_class.unique())]
-x = pd.get_dummies(pred[['flag_group', 'vessel_class', 'time_at_sea']])
-x = xgb.DMatrix(x)
 
-# predict
-pred['risk_score'] = bst.predict(x)
-pred['type'] = 'pred'
-
-
-# combine observed and predicted risk scores
-bar = pd.concat([pred, obs])
-bar = bar[['gfw_trip_id', 'ssvid', 'trip_start', 'trip_end', 'risk_score', 'type']]
-
-
-# save output for gridding and plotting
-bar['risk_class'] = [0 if x < threshold[0] else 1 if x < threshold[1] else 2 for x in bar.risk_score]
-
-bar.to_csv('fishing_iuu.csv', index=False)
-           
-# for labor abuse,
-# bar.to_csv('fishing_la.csv', index=False)
-
-
-#-----------------------------
-# SHAP interaction values
-#-----------------------------
-           
-explainer = shap.TreeExplainer(bst)
-shap_value = explainer.shap_interaction_values(x_obs)
-
-
-# feature importance
-
-flag_idx = slice(0,5,1)
-gear_idx = slice(5,14,1)
-tas_idx = slice(14,19,1)
-
-
-col_idx = list(itertools.combinations_with_replacement([flag_idx, gear_idx, tas_idx],2))
-col_name = list(itertools.combinations_with_replacement(['flag', 'gear', 'tas'],2))
-
-
-foo = [[shap_value[i,x1,x2].sum() for (x1,x2) in col_idx] for i in range(x_obs.shape[0])]
-foo = pd.DataFrame(foo)
-foo.columns = col_name
-
-
-# summarize
-importance = pd.DataFrame()
-importance['mean'] = foo.abs().mean(axis=0)
-importance['sd'] = foo.abs().std(axis=0)
-importance['se'] = foo.abs().sem(axis=0)
-importance['lower'] = foo.abs().quantile(q=0.025, axis=0)
-importance['upper'] = foo.abs().quantile(q=0.975, axis=0)
-
-importance.to_csv('fishing_iuu_importance.csv')
-
-
-# effect of features when present
-
-# model baseline
-X = xgb.DMatrix(x_obs)
-y_pred = bst.predict(X)
-base = np.mean(y_pred)
-
-
-## sum SHAP values over mutually exclusive features
-## because one is present means the others are absent
-
-## combination of features
-a = list(itertools.combinations_with_replacement(x_obs.columns,2))
-b1 = list(itertools.combinations(x_obs.columns[flag_idx],2))
-b2 = list(itertools.combinations(x_obs.columns[gear_idx],2))
-b3 = list(itertools.combinations(x_obs.columns[tas_idx],2))
-combo = list(set(a).difference(set(b1 + b2 + b3)))
-
-
-# corresponding class
-x = ['flag']*5 + ['gear']*9 + ['tas']*5
-combo2 = [(x[x_obs.columns.get_loc(x1)],x[x_obs.columns.get_loc(x2)]) for (x1,x2) in combo]
-
-
-# select solo features
-solo_idx = list(np.where([x1==x2 for (x1,x2) in combo])[0])
-
-
-# summarize
-mean = []; sd = []; se = []; lower = []; upper = []
-for x in solo_idx:
-
-    bar = foo[combo2[x]]  # SHAP values of solo features
-    true_idx = list(np.where(x_obs[combo[x][0]]==1)[0])   # find where it is true
-    bar2 = bar[true_idx]
-
-    if len(bar2) > 1:
-        mean.append(np.mean(bar2) + base)
-        sd.append(np.std(bar2))
-        se.append(scipy.stats.sem(bar2))
-        lower.append(np.quantile(bar2, 0.025) + base)
-        upper.append(np.quantile(bar2, 0.975) + base)
-
-    if len(bar2) <= 1:
-        mean.append(np.nan)
-        sd.append(np.nan)
-        se.append(np.nan)
-        lower.append(np.nan)
-        upper.append(np.nan)
-
-solo_effect = pd.DataFrame()
-solo_effect['mean'] = mean
-solo_effect['sd'] = sd
-solo_effect['se'] = se
-solo_effect['lower'] = lower
-solo_effect['upper'] = upper
-solo_effect.index = [combo[x][0] for x in solo_idx]
-solo_effect.dropna(inplace=True)
-
-
-# select combo features
-combo_idx = list(np.where([x1!=x2 for (x1,x2) in combo])[0])
-
-
-# summarize
-mean = []; sd = []; se = []; lower = []; upper = []
-for x in combo_idx:
-
-    bar1 = np.array(foo[(combo2[x][0], combo2[x][0])]) + np.array(foo[combo2[x]])
-    bar2 = np.array(foo[(combo2[x][1], combo2[x][1])]) + np.array(foo[combo2[x]])
-    bar = bar1 + bar2
-    # find where it is true
-    true_idx = list(np.where(np.logical_and(x_obs[combo[x][0]]==1, x_obs[combo[x][1]]==1))[0])
-    bar2 = bar[true_idx]
-
-    if len(bar2) > 1:
-        mean.append(np.mean(bar2) + base)
-        sd.append(np.std(bar2))
-        se.append(scipy.stats.sem(bar2))
-        lower.append(np.quantile(bar2, 0.025) + base)
-        upper.append(np.quantile(bar2, 0.975) + base)
-
-    if len(bar2) <= 1:
-        mean.append(np.nan)
-        sd.append(np.nan)
-        se.append(np.nan)
-        lower.append(np.nan)
-        upper.append(np.nan)
-
-combo_effect = pd.DataFrame()
-combo_effect['mean'] = mean
-combo_effect['sd'] = sd
-combo_effect['se'] = se
-combo_effect['lower'] = lower
-combo_effect['upper'] = upper
-combo_effect.index = [combo[x] for x in combo_idx]
-combo_effect.dropna(inplace=True)
-
-effect = pd.concat([solo_effect, combo_effect])
-
-effect.to_csv('fishing_iuu_effect.csv')
+if __name__ == '__main__':
+    main()
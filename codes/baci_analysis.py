@@ -1,168 +1,288 @@
 # %%
+import argparse
+import multiprocessing
 import os
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import country_converter as coco
 import pymc3 as pm
 import arviz as az
 import patsy
-import theano.tensor as tt
+from iso3 import psma_parties, sovereign_map, to_sovereign
+from mixed_model import fit_random_intercept, reml_summary
 
 
-var_name = sys.argv[1]
+# variable of interest
+fishing_gear = ['trollers', 'trawlers', 'squid_jigger', 'set_longlines', 'set_gillnets',
+    'purse_seine', 'pots_and_traps', 'pole_and_line', 'driftnets', 'drifting_longlines']
+all_class = fishing_gear + ['bunker', 'cargo', 'specialized_reefer', 'tanker']
+flag_groups = ['group1', 'group2', 'group3', 'china', 'other']
+VARIABLES = all_class + ['fishing_gear'] + flag_groups
 
-# %%
-#----------------------------
-# load PSMA country data
-country = pd.read_csv('data/Updated_PSMA_dates_27 JAN 2021.csv')
-country.dropna(axis=0, how='all', inplace=True)
-country = country[country.Country != 'European Union'].copy()
-country = country[country.Entry_into_force_date.notnull()].copy()
-country['Entry_into_force_date'] = pd.to_datetime(country.Entry_into_force_date)
-
-country['iso3'] = [coco.convert(names=x, to='ISO3') for x in country.Country]
-in2016 = [(x >= pd.Timestamp(2016, 1, 1)) * (x < pd.Timestamp(2017, 1, 1)) for x in country.Entry_into_force_date]
-in2017 = [(x >= pd.Timestamp(2017, 1, 1)) * (x < pd.Timestamp(2018, 1, 1)) for x in country.Entry_into_force_date]
-
-
-# list of countries with PSMA in 2016
-psma_party2016 = list(country.loc[np.array(in2016)==1, 'iso3'])
-## add denmark
-psma_party2016.append('DNK')
-
-# list of countries with PSMA in 2017
-psma_party2017 = list(country.loc[np.array(in2017)==1, 'iso3'])
-# add Greenland and Faroe Island, remove Denmark
-psma_party2017.remove('DNK')
-psma_party2017.append('GRL')
-psma_party2017.append('FRO')
 
+# %%
 #-----------------------------
-# load port visit data
-data = pd.read_csv('data/port_visit.csv')
+# load port visit data, once for all variables
+def load_visits(path='data/port_visit.csv'):
 
+    # load PSMA country data
+    # parties by year, resolved to ISO3 once and then read from data/psma_party.json
+    parties = psma_parties()
+    psma_party2016 = parties['2016']
+    psma_party2017 = parties['2017']
 
-# remove countries that ratified PSMA in 2017
-foo = data[~data.port_iso3.isin(psma_party2017)].copy()
+    data = pd.read_csv(path)
 
 
-foo = foo[foo.flag.notnull()]
-foo = foo[foo.port_iso3.notnull()]
-foo = foo[foo.vessel_class.notnull()]
+    # remove countries that ratified PSMA in 2017
+    foo = data[~data.port_iso3.isin(psma_party2017)].copy()
 
 
-# territories and their sovereign nations
-# queried from GFW on March 29, 2021
-eez = pd.read_csv('data/eez_info.csv')
-eez = eez[eez.eez_type=='200NM']
-eez = eez[eez.territory1_iso3 != eez.sovereign1_iso3]
-pair = eez[['territory1_iso3', 'sovereign1_iso3']].drop_duplicates()
+    foo = foo[foo.flag.notnull()]
+    foo = foo[foo.port_iso3.notnull()]
+    foo = foo[foo.vessel_class.notnull()]
 
-# add Mayotte, Hong Kong, Macau, Aland Islands
-pair = pair.append({'territory1_iso3':'MAC', 'sovereign1_iso3':'CHN'}, ignore_index=True)
-pair = pair.append({'territory1_iso3':'HKG', 'sovereign1_iso3':'CHN'}, ignore_index=True)
-pair = pair.append({'territory1_iso3':'MYT', 'sovereign1_iso3':'FRA'}, ignore_index=True)
-pair = pair.append({'territory1_iso3':'ALA', 'sovereign1_iso3':'FIN'}, ignore_index=True)
 
+    # add sovereign nations to their territories for port_iso3 and flag
+    sovereign = sovereign_map()
+    foo['flag_sovereign'] = to_sovereign(foo.flag, sovereign)
+    foo['port_iso3_sovereign'] = to_sovereign(foo.port_iso3, sovereign)
 
-# add sovereign nations to their territories for port_iso3 and flag
-foo['flag_sovereign'] = foo['flag']
-foo['port_iso3_sovereign'] = foo['port_iso3']
 
-for i,x in enumerate(pair.territory1_iso3):
-    foo.loc[foo.flag==x, 'flag_sovereign'] = pair.sovereign1_iso3[i]
-    foo.loc[foo.port_iso3==x, 'port_iso3_sovereign'] = pair.sovereign1_iso3[i]
+    # foreign vessels
+    bar = foo[foo.port_iso3_sovereign != foo.flag_sovereign].copy()
 
+    return bar, psma_party2016
 
-# foreign vessels
-bar = foo[foo.port_iso3_sovereign != foo.flag_sovereign].copy()
 
+# visits of one variable of interest
+def select(bar, var_name):
 
-# variable of interest
-fishing_gear = ['trollers', 'trawlers', 'squid_jigger', 'set_longlines', 'set_gillnets',
-    'purse_seine', 'pots_and_traps', 'pole_and_line', 'driftnets', 'drifting_longlines']
-all_class = fishing_gear + ['bunker', 'cargo', 'specialized_reefer', 'tanker']
+    # each vessel class
+    if var_name in all_class:
+        bar = bar[bar.vessel_class==var_name]
+    # other variable of interest for fishing vessels
+    else:
+        bar = bar[bar.vessel_class.isin(fishing_gear)]
+        # all fishing gear
+        if var_name == 'fishing_gear':
+            bar = bar
+        # flag group
+        elif var_name in flag_groups:
+            bar = bar[bar.flag_group==var_name]
+        else:
+            raise ValueError('unknown variable %s' % var_name)
 
+    return bar
 
-# each vessel class
-if var_name in all_class:
-    bar = bar[bar.vessel_class==var_name]
-# other variable of interest for fishing vessels
-else:
-    bar = bar[bar.vessel_class.isin(fishing_gear)]
-    # all fishing gear
-    if var_name == 'fishing_gear':
-        bar = bar
-    # flag group
-    elif var_name in ['group1', 'group2', 'group3', 'china', 'other']:
-        bar = bar[bar.flag_group==var_name]
-    else:
-        sys.exit()
 
+# visits by port state before (2015) and after (2017), and the model input
+def design(bar, psma_party2016):
 
-# aggregate by port state
-baz = pd.DataFrame(bar.groupby(['year', 'port_iso3']).count().start_timestamp)
-baz.rename(columns={'start_timestamp': 'n_visits'}, inplace=True)
-baz.reset_index(inplace=True)
-baz = baz[baz.year.isin([2015, 2017])].copy()
+    # aggregate by port state
+    baz = pd.DataFrame(bar.groupby(['year', 'port_iso3']).count().start_timestamp)
+    baz.rename(columns={'start_timestamp': 'n_visits'}, inplace=True)
+    baz.reset_index(inplace=True)
+    baz = baz[baz.year.isin([2015, 2017])].copy()
 
-# add PSMA & before/after
-baz['psma'] = [1 if x in psma_party2016 else 0 for x in baz.port_iso3]
-baz['after'] = [0 if x==2015 else 1 for x in baz.year]
-keep = np.intersect1d(baz.loc[baz.after==0, 'port_iso3'], baz.loc[baz.after==1, 'port_iso3'])
-baz = baz[baz.port_iso3.isin(keep)].copy()
+    # add PSMA & before/after
+    baz['psma'] = [1 if x in psma_party2016 else 0 for x in baz.port_iso3]
+    baz['after'] = [0 if x==2015 else 1 for x in baz.year]
+    keep = np.intersect1d(baz.loc[baz.after==0, 'port_iso3'], baz.loc[baz.after==1, 'port_iso3'])
+    baz = baz[baz.port_iso3.isin(keep)].copy()
 
 
-# remove countries/territories with few visits
-summary = baz.sort_values('n_visits', ascending=False).copy()
-summary['proportion'] = np.cumsum(summary.n_visits)/np.sum(summary.n_visits)
-cutoff = summary.loc[summary.proportion > 0.95, 'n_visits'].values[0]
-remove_iso3 = summary.loc[summary.n_visits < cutoff, 'port_iso3'].unique()
+    # remove countries/territories with few visits
+    summary = baz.sort_values('n_visits', ascending=False).copy()
+    summary['proportion'] = np.cumsum(summary.n_visits)/np.sum(summary.n_visits)
+    cutoff = summary.loc[summary.proportion > 0.95, 'n_visits'].values[0]
+    remove_iso3 = summary.loc[summary.n_visits < cutoff, 'port_iso3'].unique()
 
-baz = baz[~baz.port_iso3.isin(remove_iso3)].copy()
+    baz = baz[~baz.port_iso3.isin(remove_iso3)].copy()
 
-#----------------------------
-# prepare model input
+    #----------------------------
+    # prepare model input
+
+    # design matrix for fixed effects
+    X = patsy.dmatrix('1 + psma * after', data=baz, return_type='dataframe')
+    terms = list(X.columns)
+    X = np.asarray(X)
 
-# design matrix for fixed effects
-X = patsy.dmatrix('1 + psma * after', data=baz, return_type='dataframe')
-X = np.asarray(X)
+    # random effects by the port state of each row, an index into the
+    # sorted port_iso3 (the columns of the dummy matrix Z = 0 + port_iso3)
+    ports, port = np.unique(baz.port_iso3, return_inverse=True)
+    n_ports = len(ports)
 
-# design matrix for random effects
-Z = patsy.dmatrix('0 + port_iso3', data=baz, return_type='dataframe')
-Z = np.asarray(Z)
+    # response
+    Y = np.asarray(baz['n_visits'])
+    Y_scaled = Y/np.max(Y)
 
-# response
-Y = np.asarray(baz['n_visits'])
-Y_scaled = Y/np.max(Y)
+    return baz, X, port, n_ports, Y_scaled, terms
 
 
 #---------------------------
 # model
-with pm.Model() as model:
+# the random intercept of each row is gathered by port index; with the
+# dummy matrix Z it is the product with Z as before, kept for benchmark
+def build_model(X, port, n_ports, Y_scaled, Z=None):
+    with pm.Model() as model:
+
+        # fixed effects
+        beta_X = pm.Normal('beta_X', mu=0, sigma=10, shape=4)
+        mu_X = pm.math.dot(X, beta_X)
+
+        # random intercept
+        sigma_Z = pm.HalfCauchy('sigma_Z', beta=5)
+        gamma_Z_offset = pm.Normal('gamma_Z_offset', mu=0, sigma=1, shape=n_ports)
+        gamma_Z = pm.Deterministic('gamma_Z', gamma_Z_offset * sigma_Z)
+        if Z is not None:
+            mu_Z = pm.math.dot(Z, gamma_Z)
+        else:
+            mu_Z = gamma_Z[port]
+
+        ## likelihood
+        sigma = pm.HalfCauchy('sigma', beta=5)
+        mu_ = mu_X + mu_Z
+        #mu = pm.math.exp(mu_)
+        #y = pm.Gamma('y', alpha=sigma, beta=sigma/mu, observed=Y)
+        y = pm.Lognormal('y', mu=mu_, sigma=sigma, observed=Y_scaled)
+
+    return model
+
+
+# seconds per evaluation of the log density and its gradient, and seconds
+# of sampling, with the dense and the index random intercept. rows are
+# repeated to see how each scales with more data (e.g. monthly visits).
+# the dense Z is only built here
+def benchmark(var_name, X, port, n_ports, Y_scaled, terms, repeat=1, n_grad=1000, draws=1000, tune=500):
+    X = np.tile(X, (repeat, 1))
+    port = np.tile(port, repeat)
+    Y_scaled = np.tile(Y_scaled, repeat)
+
+    rows = []
+    for dense in [True, False]:
+        Z = np.eye(n_ports)[port] if dense else None
+        model = build_model(X, port, n_ports, Y_scaled, Z)
+        with model:
+            f = model.logp_dlogp_function()
+            f.set_extra_values({})
+            x = f.dict_to_array(model.test_point)
+            start = time.time()
+            for i in range(n_grad):
+                f(x)
+            grad_seconds = (time.time() - start) / n_grad
+
+            start = time.time()
+            pm.sample(draws, tune=tune, chains=1, cores=1, target_accept=0.9,
+                compute_convergence_checks=False, progressbar=False)
+            sample_seconds = time.time() - start
+
+        rows.append({'var_name': var_name, 'random_effects': 'dense' if dense else 'index',
+            'n_obs': X.shape[0], 'n_ports': n_ports, 'grad_seconds': grad_seconds,
+            'sample_seconds': sample_seconds, 'draws': draws, 'tune': tune})
+    return pd.DataFrame(rows)
 
-    # fixed effects
-    beta_X = pm.Normal('beta_X', mu=0, sigma=10, shape=4)
-    mu_X = pm.math.dot(X, beta_X)
 
-    # random intercept
-    sigma_Z = pm.HalfCauchy('sigma_Z', beta=5)
-    gamma_Z_offset = pm.Normal('gamma_Z_offset', mu=0, sigma=1, shape=Z.shape[1])
-    gamma_Z = pm.Deterministic('gamma_Z', gamma_Z_offset * sigma_Z)
-    mu_Z = pm.math.dot(Z, gamma_Z)
+#----------------------------
+# estimate one variable and summarize the fixed effects and variances.
+# nuts samples the model; advi fits a mean-field approximation and draws
+# from it; reml fits the same model on log(Y_scaled) in closed form up to
+# one variance ratio, for screening many subsets. with idata_dir the trace
+# (nuts, advi) is kept as <var_name>.nc
+def fit(var_name, X, port, n_ports, Y_scaled, terms, method='nuts', draws=5000, tune=2000, chains=2, cores=1,
+        idata_dir=None):
+    if method == 'reml':
+        est = fit_random_intercept(X, np.log(Y_scaled), port, n_ports)
+        summary = reml_summary(est, terms)
+    else:
+        model = build_model(X, port, n_ports, Y_scaled)
+        with model:
+            if method == 'advi':
+                approx = pm.fit(n=30000, method='advi')
+                trace = approx.sample(draws)
+            else:
+                trace = pm.sample(draws, tune=tune, chains=chains, target_accept=0.9, cores=cores)
+            pp = pm.sample_posterior_predictive(trace)
+            idata = az.from_pymc3(trace=trace, posterior_predictive=pp)
+
+        if idata_dir is not None:
+            idata.to_netcdf(os.path.join(idata_dir, '%s.nc' % var_name))
+
+        summary = az.summary(idata, var_names=['beta_X', 'sigma_Z', 'sigma'])
+        summary.insert(0, 'term', terms + ['sigma_Z', 'sigma'])
+
+    summary.insert(0, 'method', method)
+    summary.insert(0, 'var_name', var_name)
+    summary['n_obs'] = X.shape[0]
+    summary['n_ports'] = n_ports
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('var_names', nargs='*', default=VARIABLES,
+        help='vessel classes, fishing_gear or flag groups (default: all %d)' % len(VARIABLES))
+    parser.add_argument('--method', choices=['nuts', 'advi', 'reml'], default='nuts',
+        help='NUTS sampling, ADVI, or a fast REML fit on log(Y) (default: nuts)')
+    parser.add_argument('--draws', type=int, default=5000)
+    parser.add_argument('--tune', type=int, default=2000)
+    parser.add_argument('--chains', type=int, default=2)
+    parser.add_argument('--cores-per-model', type=int, default=None,
+        help='processes sampling the chains of one model (default: one per chain)')
+    parser.add_argument('--workers', type=int, default=None,
+        help='models fitted at the same time (default: cores / cores per model)')
+    parser.add_argument('--output', default='data/baci_summary.csv',
+        help='posterior summaries of all variables')
+    parser.add_argument('--idata-dir', default=None,
+        help='directory to keep the trace of each variable')
+    parser.add_argument('--benchmark', type=int, default=None, metavar='REPEAT',
+        help='time the dense and the index random intercept with rows repeated REPEAT times, '
+            'and write data/baci_benchmark.csv in place of fitting')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for var_name in args.var_names:
+        if var_name not in VARIABLES:
+            raise ValueError('unknown variable %s' % var_name)
+
+    cores = args.cores_per_model or args.chains
+    workers = args.workers or max(1, (os.cpu_count() or 1) // cores)
+    if args.idata_dir is not None:
+        os.makedirs(args.idata_dir, exist_ok=True)
+
+    # preprocess once and build the input of every variable
+    bar, psma_party2016 = load_visits()
+    inputs = {var_name: design(select(bar, var_name), psma_party2016)[1:]
+        for var_name in args.var_names}
+
+    # gradient and sampling time of the model, one variable after the other
+    if args.benchmark is not None:
+        result = pd.concat([benchmark(var_name, *inputs[var_name], repeat=args.benchmark,
+            draws=args.draws, tune=args.tune) for var_name in args.var_names])
+        result.to_csv('data/baci_benchmark.csv', index=False)
+        print(result)
+        return
+
+    options = dict(method=args.method, draws=args.draws, tune=args.tune, chains=args.chains,
+        cores=cores, idata_dir=args.idata_dir)
+
+    # reml takes milliseconds per variable and runs here
+    if args.method == 'reml':
+        summary = pd.concat([fit(var_name, *inputs[var_name], **options) for var_name in args.var_names])
+
+    # fits run in separate processes that start their own chain processes;
+    # spawn gives each a fresh interpreter rather than a fork of this one
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(inputs)), mp_context=context) as pool:
+            jobs = [pool.submit(fit, var_name, *inputs[var_name], **options) for var_name in args.var_names]
+            summary = pd.concat([job.result() for job in jobs])
 
-    ## likelihood
-    sigma = pm.HalfCauchy('sigma', beta=5)
-    mu_ = mu_X + mu_Z
-    #mu = pm.math.exp(mu_)
-    #y = pm.Gamma('y', alpha=sigma, beta=sigma/mu, observed=Y)
-    y = pm.Lognormal('y', mu=mu_, sigma=sigma, observed=Y_scaled)
+    summary.to_csv(args.output)
 
 
-#----------------------------
-# sample
-with model:
-    trace = pm.sample(5000, tune=2000, chains=2, target_accept=0.9, cores=1)
-    pp = pm.sample_posterior_predictive(trace)
-    idata = az.from_pymc3(trace=trace, posterior_predictive=pp)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import functools
+import numpy as np
+
+
+#-----------------------------
+# area of longitude-latitude grid cells
+#-----------------------------
+
+# radius used by the area package (WGS84 semi-major axis, m)
+EARTH_RADIUS = 6378137
+
+
+# area in km2 of cells with south-west corner at lat and sides of bin degrees,
+# R^2 * dlon * (sin(lat + bin) - sin(lat)); the same as area.area of the
+# cell polygon, which is exact for edges along meridians and parallels
+def cell_area(lat, bin):
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    return EARTH_RADIUS ** 2 * np.radians(bin) \
+        * np.abs(np.sin(lat + np.radians(bin)) - np.sin(lat)) * 1e-6
+
+
+# cell areas of the lat_bin values -90, -90 + bin, ..., 90 of a grid
+@functools.lru_cache(maxsize=None)
+def area_table(bin):
+    n = int(round(90 / bin))
+    table = cell_area(np.arange(-n, n + 1) * bin, bin)
+    table.flags.writeable = False
+    return table
+
+
+# cell area of each lat_bin; values on the grid of bin are looked up, any
+# other latitude is computed
+def cell_area_km2(lat, bin):
+    lat = np.asarray(lat, dtype='float64')
+    table = area_table(bin)
+    n = (len(table) - 1) // 2
+
+    k = np.rint(lat / bin)
+    on_grid = (np.abs(k * bin - lat) < 1e-9) & (np.abs(k) <= n)
+    idx = np.where(on_grid, k + n, 0).astype('int64')
+    return np.where(on_grid, table[idx], cell_area(lat, bin))
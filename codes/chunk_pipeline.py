@@ -0,0 +1,81 @@
+import queue
+import threading
+
+
+#-----------------------------
+# read, transform and write chunks in three threads
+#-----------------------------
+
+# the stages are connected by queues of at most depth chunks, so reading and
+# writing overlap with the transform and only a few chunks are in memory at a
+# time. pandas I/O, numpy and xgboost release the GIL for most of their work.
+# the first error of a stage stops the others and is raised by pipeline
+
+_DONE = object()
+
+
+# write(transform(chunk)) for every chunk of chunks; returns the number of
+# rows written
+def pipeline(chunks, transform, write, depth=2):
+    inbox = queue.Queue(depth)
+    outbox = queue.Queue(depth)
+    stop = threading.Event()
+    errors = []
+    n_rows = [0]
+
+    # put and get give up once another stage failed
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def read():
+        for chunk in chunks:
+            if not put(inbox, chunk):
+                return
+        put(inbox, _DONE)
+
+    def work():
+        while True:
+            chunk = get(inbox)
+            if chunk is _DONE:
+                break
+            if not put(outbox, transform(chunk)):
+                return
+        put(outbox, _DONE)
+
+    def save():
+        while True:
+            chunk = get(outbox)
+            if chunk is _DONE:
+                break
+            write(chunk)
+            n_rows[0] += len(chunk)
+
+    def run(stage):
+        try:
+            stage()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=run, args=(x,)) for x in (read, work, save)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return n_rows[0]
@@ -1,10 +1,7 @@
-import os
-import scipy as sp
-import numpy as np
-import pandas as pd
-import pandas_gbq
+from cell_area import cell_area_km2
+from query_runner import BigQueryBackend, write_query
 
-query = "
+query = """
 #standardSQL
 
 WITH
@@ -80,22 +77,11 @@ fishing_binned AS (
 
 SELECT *
 FROM fishing_binned
-"
+"""
 
-# run SQL
-df = pandas_gbq.read_gbq(sql)
+# run SQL page by page, adjusting value by a correponding area
+def add_km2(df):
+    df['km2'] = cell_area_km2(df.lat_bin, 1)
+    return df
 
-
-# adjust value by a correponding area
-from area import area
-
-def area_km2(lon, lat, bin):
-    obj = {'type':'Polygon','coordinates':[[
-        [lon, lat], [lon, lat + bin],[lon + bin, lat + bin],
-        [lon + bin, lat], [lon, lat]]]}
-    return area(obj) * 1e-6
-
-df['km2'] = df.apply(lambda row: area_km2(row['lon_bin'], row['lat_bin'], 1), axis=1)
-
-
-df.to_csv('fishing_bin_la.csv')
+write_query(BigQueryBackend(), query, 'fishing_bin_la.csv', index=True, transform=add_km2)
@@ -0,0 +1,287 @@
+import argparse
+import fractions
+import functools
+import math
+import os
+import numpy as np
+import pandas as pd
+from trip_data import POSITIONS
+from cell_area import cell_area_km2
+from risk_score import THRESHOLD
+
+
+#-----------------------------
+# fishing hours by grid cell and risk class, without BigQuery
+#-----------------------------
+
+# timestamps as int64 nanoseconds since epoch (UTC)
+def epoch_ns(x):
+    x = pd.to_datetime(pd.Series(x), utc=True).dt.tz_localize(None)
+    return x.astype('datetime64[ns]').to_numpy().view('int64')
+
+
+# ROUND in BigQuery rounds halves away from zero, np.round to even
+def round_half_away(x):
+    return np.sign(x) * np.floor(np.abs(x) + 0.5)
+
+
+# trips of each vessel sorted by start, to find the trips of positions by
+# binary search: a position belongs to the last trip starting before it if
+# that trip has not ended yet. voyages of a vessel rarely overlap; when they
+# do, up to depth earlier trips are checked too, so a position is counted
+# once for every trip that contains it as with the join in BigQuery
+class TripWindows:
+
+    def __init__(self, ssvid, trip_start, trip_end, risk_class):
+        start = epoch_ns(trip_start)
+        end = epoch_ns(trip_end)
+
+        # NULL start or end never matches in SQL
+        keep = (start != np.iinfo('int64').min) & (end != np.iinfo('int64').min)
+        ssvid = np.asarray(ssvid, dtype='object')[keep]
+        start = start[keep]
+        end = end[keep]
+        risk_class = np.asarray(risk_class)[keep]
+
+        self.vessels = pd.Index(pd.unique(ssvid))
+        vessel = self.vessels.get_indexer(ssvid)
+
+        order = np.lexsort((start, vessel))
+        self.vessel = vessel[order]
+        self.start = start[order]
+        self.end = end[order]
+        self.risk_class = risk_class[order]
+
+        # (vessel, start) as one sorted int64 key, with starts ranked among distinct starts
+        self.starts = np.unique(start)
+        self.key = self._key(self.vessel, self.start)
+
+        # how far back an earlier trip of the vessel may still be open: the
+        # first trip whose running max of ends reaches the start of each trip
+        cummax_end = pd.Series(self.end).groupby(self.vessel).cummax().to_numpy()
+        ends = np.unique(cummax_end)
+        end_key = self.vessel * (len(ends) + 1) + np.searchsorted(ends, cummax_end)
+        first = np.searchsorted(end_key, self.vessel * (len(ends) + 1) + np.searchsorted(ends, self.start))
+        self.depth = int((np.arange(len(first)) - first).max()) if len(first) else 0
+
+    def _key(self, vessel, t):
+        return vessel * (len(self.starts) + 1) + np.searchsorted(self.starts, t, side='right')
+
+    # pairs of position index and trip index (in sorted order) with the
+    # position inside the trip
+    def match(self, ssvid, timestamp):
+        vessel = self.vessels.get_indexer(np.asarray(ssvid, dtype='object'))
+        t = epoch_ns(timestamp)
+        last = np.searchsorted(self.key, self._key(vessel, t), side='right') - 1
+
+        pos = []
+        trip = []
+        for k in range(self.depth + 1):
+            idx = last - k
+            found = (vessel >= 0) & (idx >= 0)
+            idx = np.where(found, idx, 0)
+            found &= (self.vessel[idx] == vessel) & (self.start[idx] <= t) & (t <= self.end[idx])
+            pos.append(np.flatnonzero(found))
+            trip.append(idx[found])
+        return np.concatenate(pos), np.concatenate(trip)
+
+
+# dense (risk_class, lat, lon) array of summed hours. cells are centered on
+# multiples of bin, lat_bin = ROUND(lat / bin) * bin as in fishing_bin_iuu.py;
+# cells with positions but zero hours are kept as the GROUP BY does
+class FishingGrid:
+
+    def __init__(self, bin=1, n_classes=len(THRESHOLD) + 1):
+        self.bin = bin
+        self.n_lat = int(round(90 / bin))
+        self.n_lon = int(round(180 / bin))
+        self.shape = (n_classes, 2 * self.n_lat + 1, 2 * self.n_lon + 1)
+        self.hours = np.zeros(self.shape, dtype='float64')
+        self.seen = np.zeros(self.shape, dtype='bool')
+
+    def add(self, lat, lon, risk_class, hours):
+        i = round_half_away(np.asarray(lat, dtype='float64') / self.bin) + self.n_lat
+        j = round_half_away(np.asarray(lon, dtype='float64') / self.bin) + self.n_lon
+        c = np.asarray(risk_class)
+
+        keep = (c >= 0) & (c < self.shape[0]) & (i >= 0) & (i < self.shape[1]) \
+            & (j >= 0) & (j < self.shape[2])
+        cell = np.ravel_multi_index((c[keep], i[keep].astype('int64'), j[keep].astype('int64')), self.shape)
+
+        self.hours += np.bincount(cell, weights=np.asarray(hours, dtype='float64')[keep],
+            minlength=self.hours.size).reshape(self.shape)
+        self.seen.flat[cell] = True
+        return self
+
+    def to_frame(self):
+        return grid_frame(self.hours, self.seen, self.bin)
+
+
+# one row per cell with positions, columns of the fishing_bin_iuu.py query;
+# row i of the grid is lat_bin (i - n_lat) * bin, column j lon_bin (j - n_lon) * bin
+def grid_frame(hours, seen, bin):
+    n_lat = (hours.shape[1] - 1) // 2
+    n_lon = (hours.shape[2] - 1) // 2
+    c, i, j = np.nonzero(seen)
+    return pd.DataFrame({
+        'lat_bin': np.round((i - n_lat) * bin, 10),
+        'lon_bin': np.round((j - n_lon) * bin, 10),
+        'fishing_hours': hours[c, i, j],
+        'risk_class': c})
+
+
+#-----------------------------
+# the same hours at several resolutions
+#-----------------------------
+
+PYRAMID_LEVELS = [1, 0.5, 0.25, 0.1]
+
+
+# largest bin that divides all levels, 0.05 for 1, 0.5, 0.25 and 0.1
+def base_bin(levels):
+    levels = [fractions.Fraction(str(x)) for x in levels]
+    numerator = functools.reduce(math.gcd, [x.numerator for x in levels])
+    denominator = functools.reduce(lambda a, b: a * b // math.gcd(a, b), [x.denominator for x in levels])
+    return float(fractions.Fraction(numerator, denominator))
+
+
+# hours and number of positions by (risk_class, lat, lon) at every level.
+# cells centered on multiples of bin, as ROUND gives, do not nest when a
+# level is an even multiple of a finer one, so cells here have their
+# south-west corner at lat_bin, lon_bin (the corner that km2 assumes):
+# lat_bin = FLOOR(lat / bin) * bin. positions are binned once at the base
+# bin, kept sparse as the cells that occur, and each level sums base cells
+class GridPyramid:
+
+    def __init__(self, levels=PYRAMID_LEVELS, n_classes=len(THRESHOLD) + 1):
+        self.levels = list(levels)
+        self.bin = base_bin(levels)
+        self.n_lat = int(round(90 / self.bin))
+        self.n_lon = int(round(180 / self.bin))
+        self.shape = (n_classes, 2 * self.n_lat + 1, 2 * self.n_lon + 1)
+        for bin in self.levels:
+            if (90 / bin) % 1 > 1e-9:
+                raise ValueError('level %g does not divide 90 degrees' % bin)
+
+        self.cell = np.zeros(0, dtype='int64')
+        self.hours = np.zeros(0, dtype='float64')
+        self.count = np.zeros(0, dtype='int64')
+
+    def add(self, lat, lon, risk_class, hours):
+        # margin against lat / bin falling just below a whole number, e.g. 0.15 / 0.05
+        i = np.floor(np.asarray(lat, dtype='float64') / self.bin + 1e-9) + self.n_lat
+        j = np.floor(np.asarray(lon, dtype='float64') / self.bin + 1e-9) + self.n_lon
+        c = np.asarray(risk_class)
+
+        keep = (c >= 0) & (c < self.shape[0]) & (i >= 0) & (i < self.shape[1]) \
+            & (j >= 0) & (j < self.shape[2])
+        cell = np.ravel_multi_index((c[keep], i[keep].astype('int64'), j[keep].astype('int64')), self.shape)
+
+        # merge into the cells seen so far
+        cell, inverse = np.unique(np.concatenate([self.cell, cell]), return_inverse=True)
+        hours = np.concatenate([self.hours, np.asarray(hours, dtype='float64')[keep]])
+        count = np.concatenate([self.count, np.ones(keep.sum(), dtype='int64')])
+        self.hours = np.bincount(inverse, weights=hours, minlength=len(cell))
+        self.count = np.bincount(inverse, weights=count, minlength=len(cell)).astype('int64')
+        self.cell = cell
+        return self
+
+    # dense hours and number of positions of one level
+    def level(self, bin):
+        r = int(round(bin / self.bin))
+        shape = (self.shape[0], 2 * (self.n_lat // r) + 1, 2 * (self.n_lon // r) + 1)
+
+        c, i, j = np.unravel_index(self.cell, self.shape)
+        idx = np.ravel_multi_index((c, i // r, j // r), shape)
+        size = shape[0] * shape[1] * shape[2]
+        hours = np.bincount(idx, weights=self.hours, minlength=size).reshape(shape)
+        count = np.bincount(idx, weights=self.count, minlength=size).astype('int64').reshape(shape)
+        return hours, count
+
+    def to_frame(self, bin):
+        hours, count = self.level(bin)
+        return grid_frame(hours, count > 0, bin)
+
+    # one .npy per level and array, hours_<bin>.npy and count_<bin>.npy, to be
+    # opened memory-mapped with load_level; with compress also pyramid.npz
+    def save(self, path, compress=False):
+        os.makedirs(path, exist_ok=True)
+        arrays = {}
+        for bin in self.levels:
+            hours, count = self.level(bin)
+            arrays['hours_%g' % bin] = hours
+            arrays['count_%g' % bin] = count
+        for name, x in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), x)
+        if compress:
+            np.savez_compressed(os.path.join(path, 'pyramid.npz'), **arrays)
+
+
+# memory-mapped hours (or count) of one level saved by GridPyramid.save;
+# a map of a region is a slice of it
+def load_level(path, bin, name='hours'):
+    return np.load(os.path.join(path, '%s_%g.npy' % (name, bin)), mmap_mode='r')
+
+
+# grid the positions of one or more targets in a single pass over the file;
+# grids maps the targets of trips to a FishingGrid or GridPyramid
+def grid_positions(path, trips, grids, chunk_size=1000000):
+    for chunk in pd.read_csv(path, usecols=list(POSITIONS), dtype=POSITIONS, chunksize=chunk_size):
+        chunk = chunk.dropna(subset=['ssvid', 'timestamp', 'lat', 'lon'])
+        lat = chunk.lat.to_numpy()
+        lon = chunk.lon.to_numpy()
+        hours = chunk.fishing_hours.fillna(0).to_numpy()
+        for target, windows in trips.items():
+            pos, trip = windows.match(chunk.ssvid, chunk.timestamp)
+            grids[target].add(lat[pos], lon[pos], windows.risk_class[trip], hours[pos])
+    return grids
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', nargs='+', choices=['iuu', 'la'], default=['iuu', 'la'],
+        help='trips with risk classes from at_sea_analysis.py (fishing_{target}.csv)')
+    parser.add_argument('--positions', default='fishing_positions.csv',
+        help='output of fishing_positions.sql')
+    parser.add_argument('--bin', type=float, default=1,
+        help='grid resolution in degrees (default: 1, as in fishing_bin_iuu.py)')
+    parser.add_argument('--pyramid', type=float, nargs='+', default=None,
+        help='also keep these resolutions in fishing_bin_{target}/ as memory-mappable arrays, '
+            'with cells anchored at their south-west corner (e.g. 1 0.5 0.25 0.1)')
+    parser.add_argument('--compress', action='store_true',
+        help='also write the pyramid as one compressed pyramid.npz')
+    parser.add_argument('--chunk-size', type=int, default=1000000,
+        help='positions read at a time')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.pyramid is not None and args.bin not in args.pyramid:
+        raise ValueError('--bin %g is not a level of --pyramid' % args.bin)
+
+    trips = {}
+    for target in args.targets:
+        df = pd.read_csv('fishing_%s.csv' % target, usecols=['ssvid', 'trip_start', 'trip_end', 'risk_class'],
+            dtype={'ssvid': 'str'})
+        trips[target] = TripWindows(df.ssvid, df.trip_start, df.trip_end, df.risk_class)
+
+    if args.pyramid is None:
+        grids = {target: FishingGrid(args.bin) for target in trips}
+    else:
+        grids = {target: GridPyramid(args.pyramid) for target in trips}
+    grid_positions(args.positions, trips, grids, args.chunk_size)
+
+    # fishing_bin_{target}.csv for plot_fishing_contour.r, at --bin
+    for target, grid in grids.items():
+        if args.pyramid is None:
+            df = grid.to_frame()
+        else:
+            grid.save('fishing_bin_%s' % target, args.compress)
+            df = grid.to_frame(args.bin)
+        df['km2'] = cell_area_km2(df.lat_bin, args.bin)
+        df.to_csv('fishing_bin_%s.csv' % target)
+
+
+if __name__ == '__main__':
+    main()
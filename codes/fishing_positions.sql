@@ -0,0 +1,34 @@
+#standardSQL
+
+-- AIS fishing positions for fishing_grid.py, the same positions that
+-- fishing_bin_iuu.py and fishing_bin_la.py join to trips in BigQuery
+
+WITH
+
+-- This subquery identifies good segments
+good_segments AS (
+   SELECT seg_id
+   FROM `world-fishing-827.gfw_research.pipe_v20200805_segs`
+   WHERE good_seg
+      AND positions > 10
+      AND NOT overlapping_and_short
+),
+
+
+-- fishing with good segments
+fishing AS (
+   SELECT
+      ssvid,
+      timestamp,
+      lat,
+      lon,
+      IF(nnet_score2 > 0.5, hours, 0) as fishing_hours
+   FROM
+      `world-fishing-827.gfw_research.pipe_v20200805_fishing`
+   WHERE
+      seg_id IN (SELECT seg_id FROM good_segments)
+)
+
+
+SELECT *
+FROM fishing
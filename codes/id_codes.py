@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------
+# integer codes of trip and vessel identifiers
+#-----------------------------
+
+# gfw_trip_id and ssvid are replaced by dense integer codes when the trips
+# are loaded, so indexes, joins and groupbys run on integers, and decoded
+# when the outputs are written. the dictionary of each column is kept in
+# <folder>/<column>.csv; ids not seen before get the next codes, so codes of
+# earlier runs stay valid. missing ids are MISSING
+
+MISSING = -1
+
+
+class IdCodes:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.n_saved = 0
+        if path is not None and os.path.exists(path):
+            ids = pd.read_csv(path, dtype={'id': 'str'}, keep_default_na=False).id
+            self.n_saved = len(ids)
+        else:
+            ids = []
+        self.ids = pd.Index(ids, dtype='object')
+
+    # int32 while the codes fit
+    @property
+    def dtype(self):
+        return 'int32' if len(self.ids) < 2 ** 31 else 'int64'
+
+    # codes of ids, adding unseen ids in sorted order
+    def encode(self, x):
+        x = pd.Series(x)
+        new = pd.Index(x.dropna().unique()).difference(self.ids)
+        if len(new):
+            self.ids = self.ids.append(pd.Index(sorted(new), dtype='object'))
+        return self.ids.get_indexer(x).astype(self.dtype)
+
+    # ids of codes, NaN for MISSING
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        ids = self.ids.to_numpy(dtype='object')[codes]
+        ids[codes == MISSING] = np.nan
+        return ids
+
+    # written when ids were added
+    def save(self):
+        if self.path is None or len(self.ids) == self.n_saved:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        pd.DataFrame({'id': self.ids}).to_csv(self.path + '.tmp', index=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.n_saved = len(self.ids)
+
+
+# dictionaries of columns, kept in folder
+def load_ids(folder, columns=('gfw_trip_id', 'ssvid')):
+    return {x: IdCodes(os.path.join(folder, x + '.csv')) for x in columns}
+
+
+# replace the id columns of df by their codes, in place
+def encode_columns(df, ids):
+    for col, codes in ids.items():
+        if col in df.columns:
+            df[col] = codes.encode(df[col])
+    return df
+
+
+# copy of df with the id columns and index decoded, for output
+def decode_columns(df, ids):
+    df = df.copy()
+    for col, codes in ids.items():
+        if col in df.columns:
+            df[col] = codes.decode(df[col])
+        if df.index.name == col:
+            df.index = pd.Index(codes.decode(df.index), name=col)
+    return df
+
+
+# ids that are present, as strings or as codes
+def is_known(x):
+    x = pd.Series(x)
+    if x.dtype.kind in 'iu':
+        return x != MISSING
+    return x.notnull()
@@ -0,0 +1,149 @@
+import json
+import os
+import pandas as pd
+
+
+#-----------------------------
+# territories and their sovereign nations
+#-----------------------------
+
+# queried from GFW on March 29, 2021
+# `world-fishing-827.gfw_research.eez_info`
+EEZ_INFO = 'data/eez_info.csv'
+
+# lookup table shared with analyze_port_stop_duration.r
+SOVEREIGN_TABLE = 'data/territory_sovereign.csv'
+
+# Macau, Hong Kong, Mayotte, Aland Islands
+EXTRA_PAIRS = [('MAC', 'CHN'), ('HKG', 'CHN'), ('MYT', 'FRA'), ('ALA', 'FIN')]
+
+
+# territory1_iso3, sovereign1_iso3 of 200NM zones of territories
+def territory_pairs(eez_path=EEZ_INFO):
+    eez = pd.read_csv(eez_path)
+    eez = eez[eez.eez_type == '200NM']
+    eez = eez[eez.territory1_iso3 != eez.sovereign1_iso3]
+    pair = eez[['territory1_iso3', 'sovereign1_iso3']].drop_duplicates()
+    extra = pd.DataFrame(EXTRA_PAIRS, columns=['territory1_iso3', 'sovereign1_iso3'])
+    return pd.concat([pair, extra], ignore_index=True)
+
+
+# territory -> sovereign; the table is written on the first call and reused
+# while it is newer than eez_info.csv. a territory listed twice maps to its
+# last sovereign, as the assignments in a loop over the pairs did
+def sovereign_map(path=SOVEREIGN_TABLE, eez_path=EEZ_INFO):
+    if is_fresh(path, eez_path):
+        pair = pd.read_csv(path, keep_default_na=False)
+    else:
+        pair = territory_pairs(eez_path)
+        pair.to_csv(path, index=False)
+    return dict(zip(pair.territory1_iso3, pair.sovereign1_iso3))
+
+
+# iso3 codes with territories replaced by their sovereign nations
+def to_sovereign(iso3, mapping):
+    iso3 = pd.Series(iso3)
+    return iso3.map(mapping).fillna(iso3)
+
+
+# a derived file exists and is newer than the files it is made from
+def is_fresh(path, *sources):
+    if not os.path.exists(path):
+        return False
+    return all(not os.path.exists(x) or os.path.getmtime(path) >= os.path.getmtime(x) for x in sources)
+
+
+#-----------------------------
+# parties to PSMA and C188
+#-----------------------------
+
+PSMA_DATES = 'data/Updated_PSMA_dates_27 JAN 2021.csv'
+C188_DATES = 'data/c188.csv'
+
+# country name -> ISO3 from country_converter, and the PSMA parties by year
+COUNTRY_TABLE = 'data/country_iso3.csv'
+PSMA_PARTY = 'data/psma_party.json'
+
+
+# ISO3 of country names; names missing from the table are converted in one
+# call to country_converter, which is slow to load and matches each name by
+# regular expressions, and added to the table
+def country_iso3(names, path=COUNTRY_TABLE):
+    names = list(names)
+    if os.path.exists(path):
+        table = pd.read_csv(path, keep_default_na=False)
+    else:
+        table = pd.DataFrame({'name': [], 'iso3': []})
+
+    new = sorted(set(names) - set(table.name))
+    if new:
+        import country_converter as coco
+        iso3 = coco.convert(names=new, to='ISO3')
+        if isinstance(iso3, str):
+            iso3 = [iso3]
+        table = pd.concat([table, pd.DataFrame({'name': new, 'iso3': iso3})], ignore_index=True)
+        table.to_csv(path, index=False)
+
+    mapping = dict(zip(table.name, table.iso3))
+    return [mapping[x] for x in names]
+
+
+# PSMA parties with entry into force, without the European Union
+def psma_dates(path=PSMA_DATES):
+    country = pd.read_csv(path)
+    country.dropna(axis=0, how='all', inplace=True)
+    country = country[country.Country != 'European Union'].copy()
+    country = country[country.Entry_into_force_date.notnull()].copy()
+    country['Entry_into_force_date'] = pd.to_datetime(country.Entry_into_force_date)
+    return country
+
+
+def c188_dates(path=C188_DATES):
+    country = pd.read_csv(path, encoding='utf-8-sig')
+    country['date'] = pd.to_datetime(country.date)
+    return country
+
+
+# names of both lists are resolved together, so a new run converts nothing
+def resolve_parties(psma_path=PSMA_DATES, c188_path=C188_DATES):
+    psma = psma_dates(psma_path)
+    c188 = c188_dates(c188_path)
+    iso3 = country_iso3(list(psma.Country) + list(c188.participant))
+    psma['iso3'] = iso3[:len(psma)]
+    c188['iso3'] = iso3[len(psma):]
+    return psma, c188
+
+
+# ISO3 of countries with PSMA entering into force in 2016 and in 2017,
+# {'2016': [...], '2017': [...]}; kept in a file while newer than the lists
+def psma_parties(path=PSMA_PARTY, psma_path=PSMA_DATES, c188_path=C188_DATES):
+    if is_fresh(path, psma_path, c188_path):
+        with open(path) as f:
+            return json.load(f)
+
+    country = resolve_parties(psma_path, c188_path)[0]
+    date = country.Entry_into_force_date
+    in2016 = (date >= pd.Timestamp(2016, 1, 1)) & (date < pd.Timestamp(2017, 1, 1))
+    in2017 = (date >= pd.Timestamp(2017, 1, 1)) & (date < pd.Timestamp(2018, 1, 1))
+
+    # list of countries with PSMA in 2016
+    psma_party2016 = list(country.loc[in2016, 'iso3'])
+    ## add denmark
+    psma_party2016.append('DNK')
+
+    # list of countries with PSMA in 2017
+    psma_party2017 = list(country.loc[in2017, 'iso3'])
+    # add Greenland and Faroe Island, remove Denmark
+    psma_party2017.remove('DNK')
+    psma_party2017.append('GRL')
+    psma_party2017.append('FRO')
+
+    parties = {'2016': psma_party2016, '2017': psma_party2017}
+    with open(path, 'w') as f:
+        json.dump(parties, f, indent=1)
+    return parties
+
+
+if __name__ == '__main__':
+    territory_pairs().to_csv(SOVEREIGN_TABLE, index=False)
+    psma_parties()
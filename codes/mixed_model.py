@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from scipy import optimize, special
+
+
+#-----------------------------
+# linear model with a random intercept, fitted by REML
+#-----------------------------
+
+# y = X beta + gamma[group] + e, gamma ~ N(0, sigma_Z^2), e ~ N(0, sigma^2).
+# with lambda = sigma_Z^2 / sigma^2 the covariance is sigma^2 H, where H is
+# block diagonal with blocks I + lambda 11' per group, and by Sherman-Morrison
+#   H^-1 v = v - c[group] * (sum of v in group),  c = lambda / (1 + lambda n_g)
+#   log |H| = sum log(1 + lambda n_g)
+# so beta and sigma^2 are closed-form given lambda and REML is maximized over
+# log lambda alone. groups are integer indices, no dummy matrix is built
+
+
+# X' H^-1 X, X' H^-1 y and y' H^-1 y for one lambda
+def _cross_products(lam, X, y, group, n_g):
+    c = lam / (1 + lam * n_g)
+    sum_X = np.stack([np.bincount(group, weights=x, minlength=len(n_g)) for x in X.T], axis=1)
+    sum_y = np.bincount(group, weights=y, minlength=len(n_g))
+    XtX = X.T @ X - sum_X.T @ (c[:, None] * sum_X)
+    Xty = X.T @ y - sum_X.T @ (c * sum_y)
+    yty = y @ y - np.sum(c * sum_y ** 2)
+    return XtX, Xty, yty
+
+
+# minus the REML log likelihood with sigma^2 profiled out, up to a constant
+def _reml_loss(log_lam, X, y, group, n_g):
+    lam = np.exp(log_lam)
+    n, p = X.shape
+    XtX, Xty, yty = _cross_products(lam, X, y, group, n_g)
+    beta = np.linalg.solve(XtX, Xty)
+    sigma2 = (yty - Xty @ beta) / (n - p)
+    return 0.5 * ((n - p) * np.log(sigma2) + np.sum(np.log1p(lam * n_g))
+        + np.linalg.slogdet(XtX)[1])
+
+
+# estimates of beta (with covariance), sigma, sigma_Z and the predicted
+# random intercepts gamma; group holds 0..n_groups-1
+def fit_random_intercept(X, y, group, n_groups=None, bounds=(-20, 10)):
+    X = np.asarray(X, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    group = np.asarray(group)
+    n_g = np.bincount(group, minlength=n_groups or 0).astype('float64')
+    n, p = X.shape
+
+    res = optimize.minimize_scalar(_reml_loss, bounds=bounds, args=(X, y, group, n_g), method='bounded')
+    lam = np.exp(res.x)
+
+    XtX, Xty, yty = _cross_products(lam, X, y, group, n_g)
+    beta = np.linalg.solve(XtX, Xty)
+    sigma2 = (yty - Xty @ beta) / (n - p)
+
+    # best linear unbiased predictors of the intercepts
+    r = y - X @ beta
+    gamma = lam * np.bincount(group, weights=r, minlength=len(n_g)) / (1 + lam * n_g)
+
+    return {'beta': beta, 'beta_cov': sigma2 * np.linalg.inv(XtX),
+        'sigma': np.sqrt(sigma2), 'sigma_Z': np.sqrt(lam * sigma2), 'gamma': gamma,
+        'lambda': lam, 'reml': -res.fun}
+
+
+# table like az.summary: beta with normal intervals of the same 94% width,
+# point estimates of the standard deviations
+def reml_summary(est, terms, hdi_prob=0.94):
+    z = np.sqrt(2) * special.erfinv(hdi_prob)
+    sd = np.sqrt(np.diag(est['beta_cov']))
+    lower = 'hdi_%g%%' % (50 - hdi_prob * 50)
+    upper = 'hdi_%g%%' % (50 + hdi_prob * 50)
+    beta = pd.DataFrame({'mean': est['beta'], 'sd': sd,
+        lower: est['beta'] - z * sd, upper: est['beta'] + z * sd},
+        index=['beta_X[%d]' % i for i in range(len(sd))])
+    var = pd.DataFrame({'mean': [est['sigma_Z'], est['sigma']]}, index=['sigma_Z', 'sigma'])
+    summary = pd.concat([beta, var])
+    summary.insert(0, 'term', list(terms) + ['sigma_Z', 'sigma'])
+    return summary
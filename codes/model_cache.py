@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import xgboost as xgb
+
+
+#-----------------------------
+# cache of trained boosters and SHAP outputs
+#-----------------------------
+
+# files are named by a hash of everything that determines them, so a changed
+# training matrix, label or hyperparameter is a miss. entries older than
+# max_age (seconds) are removed, then the oldest until the directory is below
+# max_bytes; a hit refreshes the age of an entry. with path None the cache is
+# disabled: nothing is hashed, loads miss and saves are skipped
+class ModelCache:
+
+    def __init__(self, path=None, max_bytes=None, max_age=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    # hash of arrays, sparse matrices, data frames and json-able objects
+    def key(self, *parts):
+        if self.path is None:
+            return None
+        h = hashlib.sha1()
+        for x in parts:
+            if sp.issparse(x):
+                x = x.tocsr()
+                h.update(str(x.shape).encode())
+                for a in (x.data, x.indices, x.indptr):
+                    h.update(np.ascontiguousarray(a).tobytes())
+            elif isinstance(x, pd.DataFrame):
+                h.update(json.dumps([str(c) for c in x.columns]).encode())
+                h.update(pd.util.hash_pandas_object(x).values.tobytes())
+            elif isinstance(x, pd.Series):
+                h.update(pd.util.hash_pandas_object(x).values.tobytes())
+            elif isinstance(x, np.ndarray):
+                h.update(str(x.shape).encode())
+                h.update(np.ascontiguousarray(x).tobytes())
+            else:
+                h.update(json.dumps(x, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    # key of a model from its training data, hyperparameters and training
+    # options; thread counts do not change the model and are left out
+    def model_key(self, x, y, params, n_trees, **options):
+        params = {k: v for k, v in params.items() if k not in ('nthread', 'n_jobs')}
+        return self.key(x, y, params, n_trees, options)
+
+    # boosters are kept as UBJSON, the format xgboost picks by the .ubj extension
+    def load_booster(self, key):
+        if self.path is None:
+            return None
+        path = self._file(key, '.ubj')
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        return xgb.Booster(model_file=path)
+
+    def save_booster(self, key, bst):
+        if self.path is None:
+            return
+        path = self._file(key, '.ubj')
+        tmp = self._tmp(key, '.ubj')
+        bst.save_model(tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    # list of arrays, e.g. SHAP interaction values summed by group
+    def load_arrays(self, key):
+        if self.path is None:
+            return None
+        path = self._file(key, '.npz')
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        with np.load(path) as f:
+            return [f['arr_%d' % i] for i in range(len(f.files))]
+
+    def save_arrays(self, key, arrays):
+        if self.path is None:
+            return
+        path = self._file(key, '.npz')
+        tmp = self._tmp(key, '.npz')
+        np.savez(tmp, *arrays)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if '.tmp' in name:
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        now = time.time()
+        total = sum(size for (mtime, size, path) in entries)
+        for mtime, size, path in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or too_big):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _file(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    # written first and moved into place, so readers never see partial files
+    def _tmp(self, key, ext):
+        return os.path.join(self.path, '%s.tmp%d_%d%s' % (key, os.getpid(), threading.get_ident(), ext))
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
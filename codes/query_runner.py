@@ -0,0 +1,227 @@
+import abc
+import argparse
+import os
+import re
+import sqlite3
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import sqlglot
+except ImportError:
+    sqlglot = None
+
+
+#-----------------------------
+# run the .sql files page by page
+#-----------------------------
+
+# results come back as data frames of at most page_size rows, so a query is
+# written out without holding its full result in memory
+
+
+class BigQueryBackend:
+
+    def __init__(self, project=None):
+        from google.cloud import bigquery
+        self.client = bigquery.Client(project=project)
+
+    def pages(self, sql, page_size=100000):
+        rows = self.client.query(sql).result(page_size=page_size)
+        columns = [x.name for x in rows.schema]
+        for page in rows.pages:
+            yield pd.DataFrame.from_records([tuple(x) for x in page], columns=columns)
+
+
+# local engine through the python DB-API. tables maps table names of the
+# queries (without backticks, e.g. world-fishing-827.gfw_research.bad_mmsi)
+# to local CSV or Parquet extracts. BigQuery SQL is translated with sqlglot
+# when it is installed; without it the query has to run as written
+class DBAPIBackend(abc.ABC):
+
+    dialect = None
+
+    def __init__(self, connection, tables=None):
+        self.connection = connection
+        self.tables = {}
+        for name, path in (tables or {}).items():
+            self.tables[name] = local_name(name)
+            self.register(local_name(name), path)
+
+    # make the extract at path queryable as table name
+    @abc.abstractmethod
+    def register(self, name, path):
+        pass
+
+    def pages(self, sql, page_size=100000):
+        cursor = self.connection.cursor()
+        statements = self.translate(sql)
+        for statement in statements[:-1]:
+            cursor.execute(statement)
+        cursor.execute(statements[-1])
+        columns = [x[0] for x in cursor.description]
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    # statements of the query for this engine
+    def translate(self, sql):
+        sql = inline_temp_functions(sql)
+        for name, local in self.tables.items():
+            sql = sql.replace('`%s`' % name, local)
+        if sqlglot is not None:
+            return sqlglot.transpile(sql, read='bigquery', write=self.dialect)
+        return [x for x in sql.split(';') if x.strip()]
+
+
+class DuckDBBackend(DBAPIBackend):
+
+    dialect = 'duckdb'
+
+    def __init__(self, database=':memory:', tables=None):
+        import duckdb
+        super().__init__(duckdb.connect(database), tables)
+
+    # views over the files, so extracts are scanned and not copied
+    def register(self, name, path):
+        reader = 'read_parquet' if path.endswith('.parquet') else 'read_csv_auto'
+        self.connection.execute("CREATE OR REPLACE VIEW %s AS SELECT * FROM %s('%s')" % (name, reader, path))
+
+
+class SQLiteBackend(DBAPIBackend):
+
+    dialect = 'sqlite'
+
+    def __init__(self, database=':memory:', tables=None):
+        super().__init__(sqlite3.connect(database), tables)
+
+    # copied into the database in chunks
+    def register(self, name, path):
+        if path.endswith('.parquet'):
+            chunks = [pd.read_parquet(path)]
+        else:
+            chunks = pd.read_csv(path, chunksize=100000)
+        self.connection.execute('DROP TABLE IF EXISTS %s' % name)
+        for chunk in chunks:
+            chunk.to_sql(name, self.connection, if_exists='append', index=False)
+
+
+BACKENDS = {'bigquery': BigQueryBackend, 'duckdb': DuckDBBackend, 'sqlite': SQLiteBackend}
+
+
+# identifier for a BigQuery table name, world-fishing-827.gfw_research.bad_mmsi
+# -> world_fishing_827__gfw_research__bad_mmsi
+def local_name(name):
+    return '__'.join(re.sub(r'\W', '_', x) for x in name.split('.'))
+
+
+# the .sql files define constants with CREATE TEMP FUNCTION name() AS (...);
+# they are replaced by their values so that other engines can run the query
+def inline_temp_functions(sql):
+    pattern = re.compile(r'CREATE\s+TEMP(?:ORARY)?\s+FUNCTION\s+(\w+)\s*\(\s*\)\s*AS\s*(\(.*?\))\s*;',
+        re.IGNORECASE | re.DOTALL)
+    functions = dict(pattern.findall(sql))
+    sql = pattern.sub('', sql)
+    for name, value in functions.items():
+        sql = re.sub(r'\b%s\s*\(\s*\)' % name, lambda m: value, sql)
+    return sql
+
+
+# appends pages to a CSV or Parquet file by its extension. with index the row
+# numbers continue across pages as with DataFrame.to_csv of the whole result
+class ChunkWriter:
+
+    def __init__(self, path, index=False):
+        self.path = path
+        self.index = index
+        self.parquet = path.endswith('.parquet')
+        self.n_rows = 0
+        self.writer = None
+        if self.parquet and pyarrow is None:
+            raise ImportError('pyarrow is needed to write %s' % path)
+
+    def write(self, df):
+        if self.index:
+            df = df.set_axis(pd.RangeIndex(self.n_rows, self.n_rows + len(df)), axis=0)
+
+        tmp = self.path + '.tmp'
+        if self.parquet:
+            table = pyarrow.Table.from_pandas(df, preserve_index=self.index,
+                schema=None if self.writer is None else self.writer.schema)
+            if self.writer is None:
+                self.writer = pyarrow.parquet.ParquetWriter(tmp, table.schema)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(tmp, mode='w' if self.n_rows == 0 else 'a', header=self.n_rows == 0, index=self.index)
+        self.n_rows += len(df)
+
+    # the file appears under its name only once complete; an empty result
+    # is written as a file without rows
+    def close(self):
+        tmp = self.path + '.tmp'
+        if not os.path.exists(tmp):
+            self.write(pd.DataFrame())
+        if self.writer is not None:
+            self.writer.close()
+        os.replace(tmp, self.path)
+
+    # after a failed run, leaves no partial file
+    def discard(self):
+        tmp = self.path + '.tmp'
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# run a query and write its result page by page; transform is applied to
+# each page, e.g. to add columns. returns the number of rows
+def write_query(backend, sql, path, page_size=100000, index=False, transform=None):
+    writer = ChunkWriter(path, index)
+    for page in backend.pages(sql, page_size):
+        if transform is not None:
+            page = transform(page)
+        writer.write(page)
+    writer.close()
+    return writer.n_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query', help='.sql file')
+    parser.add_argument('output', help='.csv or .parquet file')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='bigquery')
+    parser.add_argument('--project', default=None,
+        help='BigQuery project (default: from the credentials)')
+    parser.add_argument('--database', default=':memory:',
+        help='DuckDB or SQLite database file')
+    parser.add_argument('--table', nargs=2, action='append', default=[], metavar=('NAME', 'PATH'),
+        help='local extract of a table, e.g. world-fishing-827.gfw_research.bad_mmsi bad_mmsi.csv')
+    parser.add_argument('--page-size', type=int, default=100000,
+        help='rows fetched and written at a time')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.backend == 'bigquery':
+        backend = BigQueryBackend(args.project)
+    else:
+        backend = BACKENDS[args.backend](args.database, dict(args.table))
+
+    with open(args.query) as f:
+        sql = f.read()
+    n = write_query(backend, sql, args.output, args.page_size)
+    print('%d rows written to %s' % (n, args.output))
+
+
+if __name__ == '__main__':
+    main()
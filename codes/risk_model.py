@@ -0,0 +1,86 @@
+import time
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+
+#-----------------------------
+# boosted trees for the risk score
+#-----------------------------
+
+# boost one round at a time, recording the evaluation metrics and the time
+# spent on each round; stops when the last metric of the last evaluation set
+# has not improved for early_stopping_rounds rounds
+def boost(params, dtrain, n_trees, evals, early_stopping_rounds=None, verbose_eval=None):
+    bst = xgb.Booster(params, [dtrain] + [d for (d, name) in evals])
+
+    history = []
+    best_score = np.inf
+    best_iteration = 0
+    for i in range(n_trees):
+        start = time.time()
+        bst.update(dtrain, i)
+        row = {'iteration': i, 'seconds': time.time() - start}
+
+        msg = bst.eval_set(evals, i)
+        for item in msg.split('\t')[1:]:
+            name, value = item.split(':')
+            row[name] = float(value)
+        history.append(row)
+
+        if verbose_eval and (i % verbose_eval == 0 or i == n_trees - 1):
+            print(msg)
+
+        score = row[name]
+        if score < best_score:
+            best_score = score
+            best_iteration = i
+        elif early_stopping_rounds is not None and i - best_iteration >= early_stopping_rounds:
+            if verbose_eval:
+                print(msg)
+            break
+
+    return bst, pd.DataFrame(history), best_iteration
+
+
+# train on x (sparse matrix or data frame) and y. with valid_fraction > 0 a
+# random share of rows is held out to find the number of rounds by early
+# stopping, and the model is refit on all rows with that number of rounds.
+# returns the booster, the per-round history and a summary of the fit
+def train_model(params, x, y, n_trees, feature_names=None, valid_fraction=0,
+        early_stopping_rounds=None, seed=0, verbose_eval=None):
+    y = np.asarray(y, dtype='float64')
+    dall = xgb.DMatrix(x, label=y, feature_names=feature_names)
+
+    start = time.time()
+    if valid_fraction > 0:
+        valid = np.random.RandomState(seed).rand(len(y)) < valid_fraction
+        take = x.iloc if isinstance(x, pd.DataFrame) else x
+        dtrain = xgb.DMatrix(take[np.flatnonzero(~valid)], label=y[~valid], feature_names=feature_names)
+        dvalid = xgb.DMatrix(take[np.flatnonzero(valid)], label=y[valid], feature_names=feature_names)
+
+        bst, history, best_iteration = boost(params, dtrain, n_trees,
+            [(dtrain, 'train'), (dvalid, 'valid')], early_stopping_rounds, verbose_eval)
+
+        # refit on all rows with the number of rounds that minimized the validation error
+        bst = boost(params, dall, best_iteration + 1, [(dall, 'train')])[0]
+        n_rounds = best_iteration + 1
+    else:
+        bst, history, best_iteration = boost(params, dall, n_trees, [(dall, 'train')],
+            None, verbose_eval)
+        n_rounds = len(history)
+
+    summary = {
+        'tree_method': params.get('tree_method', 'auto'),
+        'nthread': params.get('nthread'),
+        'valid_fraction': valid_fraction,
+        'early_stopping_rounds': early_stopping_rounds,
+        'max_rounds': n_trees,
+        'rounds_evaluated': len(history),
+        'best_iteration': int(best_iteration),
+        'n_trees': int(n_rounds),
+        'seconds': time.time() - start}
+    for col in history.columns.drop(['iteration', 'seconds']):
+        summary['best_' + col] = float(history[col].iloc[best_iteration])
+
+    return bst, history, summary
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+#-----------------------------
+# port risk score and risk class
+#-----------------------------
+
+RISK_LEVELS = ['no', 'low', 'med', 'high']
+
+# risk_class 0: score < 0, 1: 0 <= score < 2, 2: score >= 2
+THRESHOLD = [0, 2]
+
+# column names of the risk votes, iuu_low_to in fishing_trips.sql and
+# to_iuu_low in transshipment_trips.sql; target is 'iuu' or 'la' (labor abuse)
+FISHING_COLUMNS = '{target}_{level}_to'
+TRANSSHIPMENT_COLUMNS = 'to_{target}_{level}'
+
+
+def risk_columns(target, pattern=FISHING_COLUMNS):
+    return {level: pattern.format(target=target, level=level) for level in RISK_LEVELS}
+
+
+# trips with a port risk assessment
+def has_risk(df, target, pattern=FISHING_COLUMNS):
+    cols = risk_columns(target, pattern)
+    return df[[cols[x] for x in RISK_LEVELS]].sum(axis=1) > 0
+
+
+# weighted score from the number of risk votes
+def risk_score(df, target, pattern=FISHING_COLUMNS):
+    cols = risk_columns(target, pattern)
+    return 1/3 * df[cols['low']] + 2/3 * df[cols['med']] + df[cols['high']] - df[cols['no']]
+
+
+# bin scores into classes; NaN falls in the top class as with x < threshold
+def risk_class(score, threshold=THRESHOLD):
+    return np.digitize(np.asarray(score, dtype='float64'), threshold).astype('int8')
@@ -0,0 +1,316 @@
+import itertools
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import xgboost as xgb
+import shap
+
+
+#-----------------------------
+# sum SHAP interaction values over groups of features
+#-----------------------------
+
+# indicator matrix (groups x features) from slices or single column indices
+def group_index(groups, n_features, dtype='float32'):
+    index = np.zeros((len(groups), n_features), dtype=dtype)
+    for g, idx in enumerate(groups):
+        index[g, idx] = 1
+    return index
+
+
+# sum of shap_value[i, x1, x2] for every pair of groups in one pass
+# pairs follow the order of itertools.combinations_with_replacement(groups, 2)
+def block_sum(shap_value, groups):
+    index = group_index(groups, shap_value.shape[1], dtype=shap_value.dtype)
+    block = np.einsum('gi,nij,hj->ngh', index, shap_value, index, optimize=True)
+    upper = np.triu_indices(len(groups))
+    return block[:, upper[0], upper[1]]
+
+
+# data frame with (group, group) columns from block sums
+def group_frame(sums, names):
+    foo = pd.DataFrame(sums)
+    foo.columns = list(itertools.combinations_with_replacement(names, 2))
+    return foo
+
+
+# data frame of summed interaction values with (group, group) columns
+def group_importance(shap_value, groups, names):
+    return group_frame(block_sum(shap_value, groups), names)
+
+
+#-----------------------------
+# memory-bounded interaction values
+#-----------------------------
+
+# compute interaction values over row chunks and reduce each chunk to the block
+# sums of every grouping right away, so the (N, F, F) tensor is never held in
+# memory; with spill, raw values are also written to a memory-mapped .npy file.
+# with workers > 1, chunks are spread over a process pool that receives the
+# booster once as serialized model bytes. at most two chunks per worker are in
+# flight, and workers start from a fresh interpreter (forkserver, or spawn
+# where there is none) since this runs in threads next to xgboost
+def chunked_group_importance(bst, x, groupings, chunk_size=None, spill=None, workers=1):
+    n, n_features = x.shape
+    if chunk_size is None:
+        chunk_size = max(1, -(-n // workers))
+
+    sums = [np.zeros((n, len(groups) * (len(groups) + 1) // 2), dtype='float32')
+        for (groups, names) in groupings]
+
+    raw = None
+    if spill is not None:
+        raw = np.lib.format.open_memmap(spill, mode='w+', dtype='float32',
+            shape=(n, n_features, n_features))
+
+    starts = range(0, n, chunk_size)
+
+    def store(start, chunk_sums, shap_value):
+        end = start + chunk_sums[0].shape[0]
+        for out, block in zip(sums, chunk_sums):
+            out[start:end] = block
+        if raw is not None:
+            raw[start:end] = shap_value
+
+    if workers > 1:
+        groups_only = [groups for (groups, names) in groupings]
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                initializer=_init_worker,
+                initargs=(bytes(bst.save_raw()), list(x.columns), groups_only, raw is not None)) as pool:
+            pending = {}
+            for start in starts:
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for job in done:
+                        store(pending.pop(job), *job.result())
+                shard = np.asarray(x.iloc[start:start + chunk_size])
+                pending[pool.submit(_shard_group_sums, shard)] = start
+            for job in wait(pending).done:
+                store(pending[job], *job.result())
+    else:
+        explainer = shap.TreeExplainer(bst)
+        for start in starts:
+            shap_value = explainer.shap_interaction_values(x.iloc[start:start + chunk_size])
+            store(start, [block_sum(shap_value, groups) for (groups, names) in groupings], shap_value)
+            del shap_value
+
+    if raw is not None:
+        raw.flush()
+
+    return [group_frame(out, names) for out, (groups, names) in zip(sums, groupings)]
+
+
+# chunked_group_importance with the block sums kept in a ModelCache under key
+def cached_group_importance(cache, key, bst, x, groupings, **kwargs):
+    sums = cache.load_arrays(key)
+    if sums is None:
+        frames = chunked_group_importance(bst, x, groupings, **kwargs)
+        cache.save_arrays(key, [foo.values for foo in frames])
+        return frames
+    return [group_frame(out, names) for out, (groups, names) in zip(sums, groupings)]
+
+
+#-----------------------------
+# repeated rows
+#-----------------------------
+
+# one-hot and indicator features take few distinct rows, so predictions and
+# interaction values are computed once per pattern and statistics are
+# weighted by the number of rows of each pattern
+
+
+# rows as bytes, with every NaN the same value
+def _row_keys(x):
+    x = np.asarray(x)
+    if x.dtype.kind == 'f':
+        x = np.where(np.isnan(x), np.inf, x)
+    x = np.ascontiguousarray(x)
+    return x.view(np.dtype((np.void, x.dtype.itemsize * x.shape[1]))).ravel()
+
+
+# index of the first row of each distinct row of a data frame, array or
+# sparse matrix, the pattern of every row and the number of rows per pattern;
+# sparse matrices are densified in chunks, as bytes when they hold 0/1 only
+def unique_rows(x, chunk_size=1000000):
+    if sp.issparse(x):
+        x = x.tocsr()
+        indicator = np.all(x.data == 1)
+        keys = []
+        for start in range(0, x.shape[0], chunk_size):
+            chunk = x[start:start + chunk_size]
+            keys.append(_row_keys((chunk != 0).toarray().astype('uint8') if indicator else chunk.toarray()))
+        keys = np.concatenate(keys)
+    else:
+        keys = _row_keys(x)
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    return first, inverse.ravel(), counts
+
+
+def take_rows(x, idx):
+    return x.iloc[idx] if isinstance(x, pd.DataFrame) else x[idx]
+
+
+# bst.predict over the distinct rows, broadcast back to every row
+def predict_unique(bst, x, feature_names=None):
+    first, inverse, counts = unique_rows(x)
+    return bst.predict(xgb.DMatrix(take_rows(x, first), feature_names=feature_names))[inverse]
+
+
+#-----------------------------
+# summaries
+#-----------------------------
+
+# quantiles of many groups of values in one sort; segments are group labels.
+# with weights each value counts as that many repeated values
+def grouped_quantile(values, segments, n_segments, q, weights=None):
+    order = np.lexsort((values, segments))
+    values = values[order]
+    segments = segments[order]
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype='float64')[order]
+    counts = np.bincount(segments, weights=weights, minlength=n_segments)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # value at position p of the repeated values: the first whose cumulative weight exceeds p
+    end = np.cumsum(weights)
+    pos = (counts - 1) * q
+    lower = np.floor(pos)
+    upper = np.ceil(pos)
+    valid = counts > 0
+    lo = np.full(n_segments, np.nan)
+    hi = np.full(n_segments, np.nan)
+    lo[valid] = values[np.searchsorted(end, (starts + lower)[valid], side='right')]
+    hi[valid] = values[np.searchsorted(end, (starts + upper)[valid], side='right')]
+    return lo + (hi - lo) * (pos - lower)
+
+
+# mean, sd, se and 95% interval of the absolute summed interaction values of
+# each pair of groups; with weights, rows stand for that many repeated rows
+def importance_summary(foo, weights=None):
+    importance = pd.DataFrame()
+    if weights is None:
+        importance['mean'] = foo.abs().mean(axis=0)
+        importance['sd'] = foo.abs().std(axis=0)
+        importance['se'] = foo.abs().sem(axis=0)
+        importance['lower'] = foo.abs().quantile(q=0.025, axis=0)
+        importance['upper'] = foo.abs().quantile(q=0.975, axis=0)
+        return importance
+
+    v = np.abs(foo.to_numpy(dtype='float64'))
+    w = np.asarray(weights, dtype='float64')
+    n = w.sum()
+    mean = w @ v / n
+    sd = np.sqrt(w @ (v - mean) ** 2 / (n - 1))
+
+    n_rows, n_cols = v.shape
+    segments = np.repeat(np.arange(n_cols), n_rows)
+    importance['mean'] = pd.Series(mean, index=foo.columns)
+    importance['sd'] = sd
+    importance['se'] = sd / np.sqrt(n)
+    importance['lower'] = grouped_quantile(v.T.ravel(), segments, n_cols, 0.025, np.tile(w, n_cols))
+    importance['upper'] = grouped_quantile(v.T.ravel(), segments, n_cols, 0.975, np.tile(w, n_cols))
+    return importance
+
+
+# mean, sd, se and 95% interval of summed SHAP values for every solo feature and
+# every pair of features, over the rows where they are present (x == 1).
+# foo has (class, class) columns from group_frame, classes gives the class of
+# each column of x, and pairs within each exclusive slice are skipped because
+# one feature being present means the others are absent. with weights,
+# rows stand for that many repeated rows
+def effect_summary(foo, x, classes, exclusive, base, weights=None):
+    columns = list(x.columns)
+    present = np.asarray(x) == 1
+    w = np.ones(len(present)) if weights is None else np.asarray(weights, dtype='float64')
+
+    excluded = set()
+    for idx in exclusive:
+        excluded.update(itertools.combinations(range(len(columns))[idx], 2))
+
+    solo = [(i, i) for i in range(len(columns))]
+    combo = [(i, j) for (i, j) in itertools.combinations(range(len(columns)), 2)
+        if (i, j) not in excluded]
+
+    # pairs sharing the same summed SHAP values
+    blocks = {}
+    for n, (i, j) in enumerate(solo + combo):
+        key = (classes[i], None) if i == j else (classes[i], classes[j])
+        blocks.setdefault(key, []).append(n)
+
+    n_pairs = len(solo) + len(combo)
+    first = np.array([i for (i, j) in solo + combo])
+    second = np.array([j for (i, j) in solo + combo])
+
+    count = np.zeros(n_pairs)
+    total = np.zeros(n_pairs)
+    values = []
+    segments = []
+    row_weights = []
+    for (k1, k2), idx in blocks.items():
+        if k2 is None:
+            v = np.asarray(foo[(k1, k1)], dtype='float64')
+        else:
+            v = np.asarray(foo[(k1, k1)], dtype='float64') + np.asarray(foo[(k2, k2)], dtype='float64') \
+                + 2 * np.asarray(foo[(k1, k2)], dtype='float64')
+        idx = np.array(idx)
+        mask = present[:, first[idx]] & present[:, second[idx]]
+
+        count[idx] = w @ mask
+        total[idx] = (v * w) @ mask
+
+        rows, cols = np.nonzero(mask)
+        values.append(v[rows])
+        segments.append(idx[cols])
+        row_weights.append(w[rows])
+
+    values = np.concatenate(values)
+    segments = np.concatenate(segments)
+    row_weights = np.concatenate(row_weights)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        ss = np.bincount(segments, weights=row_weights * (values - mean[segments]) ** 2, minlength=n_pairs)
+        sd = np.sqrt(ss / count)
+        se = np.sqrt(ss / (count - 1)) / np.sqrt(count)
+    lower = grouped_quantile(values, segments, n_pairs, 0.025, row_weights)
+    upper = grouped_quantile(values, segments, n_pairs, 0.975, row_weights)
+
+    effect = pd.DataFrame({'mean': mean + base, 'sd': sd, 'se': se,
+        'lower': lower + base, 'upper': upper + base})
+    effect.loc[count <= 1] = np.nan
+
+    solo_effect = effect.iloc[:len(solo)].copy()
+    solo_effect.index = columns
+    solo_effect.dropna(inplace=True)
+
+    combo_effect = effect.iloc[len(solo):].copy()
+    combo_effect.index = [(columns[i], columns[j]) for (i, j) in combo]
+    combo_effect.dropna(inplace=True)
+
+    return pd.concat([solo_effect, combo_effect])
+
+
+#-----------------------------
+# process pool workers
+#-----------------------------
+
+_worker = {}
+
+
+# rebuild the booster and explainer once per worker process
+def _init_worker(model, columns, groupings, keep_raw):
+    bst = xgb.Booster(model_file=bytearray(model))
+    bst.set_param({'nthread': 1})
+    _worker['explainer'] = shap.TreeExplainer(bst)
+    _worker['columns'] = columns
+    _worker['groupings'] = groupings
+    _worker['keep_raw'] = keep_raw
+
+
+def _shard_group_sums(values):
+    x = pd.DataFrame(values, columns=_worker['columns'])
+    shap_value = _worker['explainer'].shap_interaction_values(x)
+    sums = [block_sum(shap_value, groups) for groups in _worker['groupings']]
+    return sums, (shap_value if _worker['keep_raw'] else None)
@@ -1,279 +1,231 @@
-import time
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pandas as pd
 import xgboost as xgb
-import shap
-import itertools
-import scipy
+from shap_summary import cached_group_importance, effect_summary, importance_summary, \
+    predict_unique, unique_rows
+from id_codes import decode_columns, encode_columns, load_ids
+from model_cache import ModelCache
+from risk_model import train_model
+from trip_data import load_encounters, load_loitering
+from trip_features import TRANSSHIPMENT_GROUPS, transshipment_features
+from trip_join import SortedIndex, join_events
+from risk_score import THRESHOLD, TRANSSHIPMENT_COLUMNS, has_risk, risk_class, risk_score
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', nargs='+', choices=['iuu', 'la'], default=['iuu'],
+        help='risk of IUU fishing (iuu) and/or labor abuse (la), run concurrently on the same trips')
+    parser.add_argument('--threshold', type=float, nargs=2, default=THRESHOLD,
+        help='risk score thresholds between risk classes 0/1 and 1/2')
+    parser.add_argument('--shap-chunk-size', type=int, default=None,
+        help='rows per SHAP interaction chunk (default: all rows at once)')
+    parser.add_argument('--shap-spill', default=None,
+        help='memory-mapped .npy file to keep raw SHAP interaction values, {target} is replaced by the target')
+    parser.add_argument('--shap-workers', type=int, default=1,
+        help='processes for SHAP interaction values (default: 1, serial)')
+    parser.add_argument('--unique-patterns', action='store_true',
+        help='predict and explain each distinct feature row once, weighting statistics by its number of trips')
+    parser.add_argument('--tree-method', default=None, choices=['exact', 'approx', 'hist'],
+        help='xgboost tree construction (default: xgboost default)')
+    parser.add_argument('--nthread', type=int, default=None,
+        help='xgboost threads per target (default: cores split between targets)')
+    parser.add_argument('--valid-fraction', type=float, default=0,
+        help='share of observed trips held out for early stopping, the model is then refit on all (default: 0, off)')
+    parser.add_argument('--early-stopping-rounds', type=int, default=10,
+        help='stop after this many rounds without improvement on the held-out trips')
+    parser.add_argument('--ids-dir', default='ids',
+        help='directory of the dictionaries of gfw_trip_id and ssvid codes (default: ids)')
+    parser.add_argument('--cache-dir', default=None,
+        help='directory to reuse trained models and SHAP values between runs')
+    parser.add_argument('--cache-max-gb', type=float, default=None,
+        help='remove the oldest cache entries above this size')
+    parser.add_argument('--cache-max-days', type=float, default=None,
+        help='remove cache entries unused for this many days')
+    return parser.parse_args()
+
+
+# train, predict and explain the risk of one target; the trip features (foo),
+# trip risk votes (bar), feature groups and event tables are shared between
+# targets and only read here; gfw_trip_id and ssvid are codes of ids
+def run_target(target, foo, bar, group_slices, encounter, loitering, ids, args, cache, nthread):
+    threshold = args.threshold
+
+    # get a subset with port risk assessment
+    obs = foo[has_risk(bar, target, TRANSSHIPMENT_COLUMNS)].copy()
+
+
+    # risk score
+    obs['risk_score'] = risk_score(bar, target, TRANSSHIPMENT_COLUMNS)
+    obs['type'] = 'obs'
+
+
+    # input for the model to predict missing port risk score
+    x_obs = obs.drop(columns=['risk_score', 'type']).copy()
+    y_obs = obs.risk_score.astype('float')
+
+
+    # fit model
+    params = {'eta':0.01, 'min_child_weight':1, 'max_depth':10, 'colsample_bytree':0.6,
+        'nthread':nthread}
+    if args.tree_method is not None:
+        params['tree_method'] = args.tree_method
+    n_trees = 300
+
+
+    # reuse a booster trained on the same data and hyperparameters
+    model_key = cache.model_key(x_obs, y_obs, params, n_trees,
+        valid_fraction=args.valid_fraction, early_stopping_rounds=args.early_stopping_rounds)
+    bst = cache.load_booster(model_key)
+    if bst is None:
+        bst, history, summary = train_model(params, x_obs, y_obs, n_trees, None,
+            valid_fraction=args.valid_fraction, early_stopping_rounds=args.early_stopping_rounds,
+            verbose_eval=50)
+        cache.save_booster(model_key, bst)
+
+        # metrics and time of each round, and the final number of trees
+        history.to_csv('transshipment_%s_train.csv' % target, index=False)
+        with open('transshipment_%s_train.json' % target, 'w') as f:
+            json.dump(summary, f, indent=1)
+    bst.set_param({'nthread': nthread})
+
+
+    #______________________________________
+    # predict
+    unobserved = foo.drop(obs.index)
+
+    if args.unique_patterns:
+        y_pred = predict_unique(bst, unobserved)
+    else:
+        y_pred = bst.predict(xgb.DMatrix(unobserved))
+
+    # observed and predicted risk scores of all trips, sorted once by trip
+    index = SortedIndex(np.concatenate([obs.index, unobserved.index]))
+    score = np.concatenate([obs.risk_score.to_numpy(dtype='float64'), y_pred])
+
+    # coordinates of encounters and loitering events with the risk of their trip
+    xy = join_events(index, score, [encounter, loitering])
+    xy['risk_class'] = risk_class(xy.risk_score, threshold)
 
+    decode_columns(xy, ids).to_csv('transshipment_%s.csv' % target)
 
-#_________________________________
-# run transshipment_trips.sql and save as transhipment_trips.csv
-encounter = pd.read_csv('transshipment_trips.csv')
 
-# run transshipment_loitering.sql and save as transhipment_loitering.csv
-loitering = pd.read_csv('transshipment_loitering.csv')
+    #________________________________________________
+    # SHAP interaction values
+
+    # features of a trip are exclusive within is_tas, is_flag and loitering,
+    # while a trip can meet several fishing vessels: each with_ feature is its own class
+    exclusive = [group_slices[x] for x in ['is_tas', 'is_flag', 'loitering']]
+    with_features = [i for x in ['with_flag', 'with_gear']
+        for i in range(group_slices[x].start, group_slices[x].stop)]
 
+    # groups for feature importance, and for the effect of features when present
+    importance_groups = ([group_slices[x] for x in TRANSSHIPMENT_GROUPS], TRANSSHIPMENT_GROUPS)
 
-#_________________________________
-# trips with predictors
-all = encounter.dropna(subset=['carrier_flag_group','neighbor_flag_group', 'time_at_sea', 'neighbor_vessel_class']).copy()
-all.reset_index(inplace=True, drop=True)
+    effect_groups = (exclusive[:2] + with_features + exclusive[2:],
+        ['is_tas', 'is_flag'] + [x_obs.columns[i] for i in with_features] + ['loitering'])
 
+    # model baseline, over all observed trips
+    if args.unique_patterns:
+        base = np.mean(predict_unique(bst, x_obs))
+    else:
+        base = np.mean(bst.predict(xgb.DMatrix(x_obs)))
 
-# data frame for predictors
-foo = all.groupby('gfw_trip_id').first()
+    # with unique patterns, each distinct trip is explained once and weighted
+    # by its number of trips
+    shap_key = [model_key, 'shap']
+    if args.unique_patterns:
+        first, inverse, weights = unique_rows(x_obs)
+        x_obs = x_obs.iloc[first]
+        shap_key.append('unique')
+    else:
+        weights = None
 
+    # both groupings are reduced from the same row chunks
+    spill = None if args.shap_spill is None else args.shap_spill.format(target=target)
+    groupings = [importance_groups, effect_groups]
+    shap_importance, shap_effect = cached_group_importance(cache, cache.key(*shap_key, groupings), bst, x_obs, groupings,
+        chunk_size=args.shap_chunk_size, spill=spill, workers=args.shap_workers)
 
-# add time at sea
-tas = all.time_at_sea.unique()
-for i in range(len(tas)):
-    foo[tas[i]] = [1 if x == tas[i] else 0 for x in foo.time_at_sea]
 
+    #________________________________
+    # feature importance
 
-# add flags of carrier vessels
-carrier_flags = all.carrier_flag_group.unique()
-for i in range(len(carrier_flags)):
-    foo[carrier_flags[i]] = [1 if x == carrier_flags[i] else 0 for x in foo.carrier_flag_group]
 
+    # summarize
+    importance = importance_summary(shap_importance, weights)
 
-foo = foo[np.append(tas, carrier_flags)]
+    importance.to_csv('transshipment_%s_importance.csv' % target)
 
 
-# add flags of encountered fishing vessels
-bar = pd.DataFrame()
-bar['gfw_trip_id'] = all.gfw_trip_id
-neighbor_flags = all.neighbor_flag_group.unique()
-for i in range(len(neighbor_flags)):
-    bar['with_' + neighbor_flags[i]] = [1 if x == neighbor_flags[i] else 0 for x in all.neighbor_flag_group]
+    #___________________________
+    # effect of features when present
 
+    ## sum SHAP values over mutually exclusive features
+    ## because one is present means the others are absent
 
-# add vessel class of encountered fishing vessels
-neighbor_vessels = all.neighbor_vessel_class.unique()
-for i in range(len(neighbor_vessels)):
-    bar['with_' + neighbor_vessels[i]] = [1 if x == neighbor_vessels[i] else 0 for x in all.neighbor_vessel_class]
+    # class of each feature
+    x = [None] * x_obs.shape[1]
+    for name, idx in zip(effect_groups[1], effect_groups[0]):
+        if isinstance(idx, slice):
+            x[idx] = [name] * (idx.stop - idx.start)
+        else:
+            x[idx] = name
 
+    # solo features and combinations of features, summarized in one pass
+    effect = effect_summary(shap_effect, x_obs, x, exclusive, base, weights)
 
-# summarize within trip id (0: no encounter, 1: encountred)
-bar = bar.groupby('gfw_trip_id').sum()
-bar = bar.applymap(lambda x: (x > 0)*1) #convert n > 0 to n = 1
-foo = foo.merge(bar, left_index=True, right_index=True)
+    effect.to_csv('transshipment_%s_effect.csv' % target)
 
 
-# number of loitering
-foo['loitering'] = loitering.groupby('gfw_trip_id').count().ssvid
-foo['loitering'] = foo.loitering.fillna(0)
-foo['loitering'] = [1 if x > 0 else 0 for x in foo.loitering]
-foo['no_loitering'] = 1 - foo.loitering
+def main():
+    args = parse_args()
 
+    #_________________________________
+    # run transshipment_trips.sql and save as transhipment_trips.csv
+    encounter = load_encounters('transshipment_trips.csv')
 
-# get a subset with port risk assessment
-bar = all.groupby('gfw_trip_id').first()
-bar['n_total_to'] = bar.to_iuu_no + bar.to_iuu_low + bar.to_iuu_med + bar.to_iuu_high
-## for labor abuse
-## bar['n_total_to'] = bar.to_la_no + bar.to_la_low + bar.to_la_med + bar.to_la_high
-obs = foo[bar.n_total_to > 0].copy()
+    # run transshipment_loitering.sql and save as transhipment_loitering.csv
+    loitering = load_loitering('transshipment_loitering.csv')
 
+    # trips and vessels by integer codes from here on
+    ids = load_ids(args.ids_dir)
+    encode_columns(encounter, ids)
+    encode_columns(loitering, ids)
+    for x in ids.values():
+        x.save()
 
-# risk score
-obs['risk_score'] = 1/3*bar.to_iuu_low + 2/3*bar.to_iuu_med + bar.to_iuu_high - bar.to_iuu_no
-## for labor abuse
-## obs['risk_score'] = 1/3*bar.to_la_low + 2/3*bar.to_la_med + bar.to_la_high - bar.to_la_no
-obs['type'] = 'obs'
 
+    #_________________________________
+    # trips with predictors
+    all = encounter.dropna(subset=['carrier_flag_group','neighbor_flag_group', 'time_at_sea', 'neighbor_vessel_class']).copy()
+    all.reset_index(inplace=True, drop=True)
 
-# input for the model to predict missing port risk score
-x_obs = obs.drop(columns=['risk_score', 'type']).copy()
-y_obs = obs.risk_score.astype('float')
-dtrain = xgb.DMatrix(data=x_obs,label=y_obs)
 
+    # one row of indicators per trip, and the column slice of each feature group
+    foo, group_slices = transshipment_features(all, loitering)
 
-# fit model
-params = {'eta':0.01, 'min_child_weight':1, 'max_depth':10, 'colsample_bytree':0.6}
-n_trees = 300
 
+    # port risk votes of each trip
+    bar = all.groupby('gfw_trip_id').first()
 
-evals_result = {}
-bst = xgb.train(params=params, dtrain=dtrain, num_boost_round=n_trees, evals=[(dtrain, 'train')],
-    verbose_eval=50, evals_result=evals_result)
+    # targets run concurrently in threads and split the cores between them
+    nthread = args.nthread
+    if nthread is None:
+        nthread = max(1, (os.cpu_count() or 1) // len(args.targets))
 
+    cache = ModelCache(args.cache_dir,
+        max_bytes=None if args.cache_max_gb is None else args.cache_max_gb * 1e9,
+        max_age=None if args.cache_max_days is None else args.cache_max_days * 86400)
+    with ThreadPoolExecutor(max_workers=len(args.targets)) as pool:
+        jobs = [pool.submit(run_target, target, foo, bar, group_slices, encounter, loitering, ids, args, cache, nthread)
+            for target in args.targets]
+        for job in jobs:
+            job.result()
 
-#______________________________________
-# predict
-bar = foo.drop(obs.index).copy()
 
-x = xgb.DMatrix(bar)
-y_pred = bst.predict(x)
-y_pred = pd.DataFrame(y_pred, columns=['risk_score'], index=bar.index)
-bar['risk_score'] = y_pred
-bar['type'] = 'pred'
-
-# combine observed and predicted risk scores
-foo = pd.concat([obs, bar])
-
-# add coordinates
-encounter.set_index('gfw_trip_id', inplace=True)
-encounter['risk_score'] = foo.risk_score
-encounter.dropna(subset=['risk_score'], inplace=True)
-x = encounter[['lon_mean', 'lat_mean', 'risk_score']].copy()
-
-loitering.set_index('gfw_trip_id', inplace=True)
-loitering['risk_score'] = foo.risk_score
-loitering.dropna(subset=['risk_score'], inplace=True)
-y = loitering[['lon_mean', 'lat_mean', 'risk_score']].copy()
-
-xy = pd.concat([x, y])
-threshold = [0,2]
-xy['risk_class'] = [0 if x < threshold[0] else 1 if x < threshold[1] else 2 for x in xy.risk_score]
-
-
-#________________________________________________
-# SHAP interaction values
-
-explainer = shap.TreeExplainer(bst)
-shap_value = explainer.shap_interaction_values(x_obs)
-
-
-#________________________________
-# feature importance
-
-is_tas_idx = slice(0,5,1)
-is_flag_idx = slice(5,10,1)
-with_flag_idx = slice(10,15,1)
-with_gear_idx = slice(15,23,1)
-loitering_idx = slice(23,25,1)
-
-col_idx = list(itertools.combinations_with_replacement([is_tas_idx, is_flag_idx, with_flag_idx, with_gear_idx, loitering_idx],2))
-col_name = list(itertools.combinations_with_replacement(['is_tas', 'is_flag', 'with_flag', 'with_gear', 'loitering'],2))
-
-
-foo = [[shap_value[i,x1,x2].sum() for (x1,x2) in col_idx] for i in range(x_obs.shape[0])]
-foo = pd.DataFrame(foo)
-foo.columns = col_name
-
-
-# summarize
-importance = pd.DataFrame()
-importance['mean'] = foo.abs().mean(axis=0)
-importance['sd'] = foo.abs().std(axis=0)
-importance['se'] = foo.abs().sem(axis=0)
-importance['lower'] = foo.abs().quantile(q=0.025, axis=0)
-importance['upper'] = foo.abs().quantile(q=0.975, axis=0)
-
-
-#___________________________
-# effect of features when present
-
-# model baseline
-X = xgb.DMatrix(x_obs)
-y_pred = bst.predict(X)
-base = np.mean(y_pred)
-
-col_idx = list(itertools.combinations_with_replacement([is_tas_idx, is_flag_idx,
-    10,11,12,13,14,15,16,17,18,19,20,21,22,loitering_idx],2))
-
-
-col_name = list(itertools.combinations_with_replacement(['is_tas', 'is_flag', 'with_china', 'with_group3',
-    'with_group2', 'with_other', 'with_group1', 'with_squid_jigger',
-    'with_set_longline', 'with_drifting_longline', 'with_pots_and_traps',
-    'with_trawlers', 'with_purse_seine', 'with_pole_and_line',
-    'with_set_gillnet', 'loitering'],2))
-
-
-foo = [[shap_value[i,x1,x2].sum() for (x1,x2) in col_idx] for i in range(x_obs.shape[0])]
-foo = pd.DataFrame(foo)
-foo.columns = col_name
-
-
-## combination of features
-a = list(itertools.combinations_with_replacement(x_obs.columns,2))
-b1 = list(itertools.combinations(x_obs.columns[is_tas_idx],2))
-b2 = list(itertools.combinations(x_obs.columns[is_flag_idx],2))
-b3 = list(itertools.combinations(x_obs.columns[loitering_idx],2))
-combo = list(set(a).difference(set(b1 + b2 + b3)))
-
-
-# corresponding class
-x = ['is_tas']*5 + ['is_flag']*5 + ['with_china', 'with_group3',
-    'with_group2', 'with_other', 'with_group1', 'with_squid_jigger',
-    'with_set_longline', 'with_drifting_longline', 'with_pots_and_traps',
-    'with_trawlers', 'with_purse_seine', 'with_pole_and_line',
-    'with_set_gillnet'] + ['loitering']*2
-combo2 = [(x[x_obs.columns.get_loc(x1)],x[x_obs.columns.get_loc(x2)]) for (x1,x2) in combo]
-
-
-# select solo features
-solo_idx = list(np.where([x1==x2 for (x1,x2) in combo])[0])
-
-
-# summarize
-mean = []; sd = []; se = []; lower = []; upper = []
-for x in solo_idx:
-
-    bar = foo[combo2[x]]  # SHAP values of solo features
-    true_idx = list(np.where(x_obs[combo[x][0]]==1)[0])   # find where it is true
-    bar2 = bar[true_idx]
-
-    if len(bar2) > 1:
-        mean.append(np.mean(bar2) + base)
-        sd.append(np.std(bar2))
-        se.append(scipy.stats.sem(bar2))
-        lower.append(np.quantile(bar2, 0.025) + base)
-        upper.append(np.quantile(bar2, 0.975) + base)
-
-    if len(bar2) <= 1:
-        mean.append(np.nan)
-        sd.append(np.nan)
-        se.append(np.nan)
-        lower.append(np.nan)
-        upper.append(np.nan)
-
-solo_effect = pd.DataFrame()
-solo_effect['mean'] = mean
-solo_effect['sd'] = sd
-solo_effect['se'] = se
-solo_effect['lower'] = lower
-solo_effect['upper'] = upper
-solo_effect.index = [combo[x][0] for x in solo_idx]
-solo_effect.dropna(inplace=True)
-
-
-# select combo features
-combo_idx = list(np.where([x1!=x2 for (x1,x2) in combo])[0])
-
-
-# summarize
-mean = []; sd = []; se = []; lower = []; upper = []
-for x in combo_idx:
-
-    bar1 = np.array(foo[(combo2[x][0], combo2[x][0])]) + np.array(foo[combo2[x]])
-    bar2 = np.array(foo[(combo2[x][1], combo2[x][1])]) + np.array(foo[combo2[x]])
-    bar = bar1 + bar2
-    # find where it is true
-    true_idx = list(np.where(np.logical_and(x_obs[combo[x][0]]==1, x_obs[combo[x][1]]==1))[0])
-    bar2 = bar[true_idx]
-
-    if len(bar2) > 1:
-        mean.append(np.mean(bar2) + base)
-        sd.append(np.std(bar2))
-        se.append(scipy.stats.sem(bar2))
-        lower.append(np.quantile(bar2, 0.025) + base)
-        upper.append(np.quantile(bar2, 0.975) + base)
-
-    if len(bar2) <= 1:
-        mean.append(np.nan)
-        sd.append(np.nan)
-        se.append(np.nan)
-        lower.append(np.nan)
-        upper.append(np.nan)
-
-combo_effect = pd.DataFrame()
-combo_effect['mean'] = mean
-combo_effect['sd'] = sd
-combo_effect['se'] = se
-combo_effect['lower'] = lower
-combo_effect['upper'] = upper
-combo_effect.index = [combo[x] for x in combo_idx]
-combo_effect.dropna(inplace=True)
-
-effect = pd.concat([solo_effect, combo_effect])
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+#-----------------------------
+# columns and types of the query outputs
+#-----------------------------
+
+RISK_LEVELS = ['no', 'low', 'med', 'high']
+
+# output of fishing_trips.sql
+FISHING_TRIPS = dict(
+    [('gfw_trip_id', 'str'), ('ssvid', 'str'), ('trip_start', 'str'), ('trip_end', 'str'),
+     ('flag_group', 'category'), ('vessel_class', 'category'), ('time_at_sea', 'category')] +
+    [('iuu_%s_to' % x, 'float64') for x in RISK_LEVELS] +
+    [('la_%s_to' % x, 'float64') for x in RISK_LEVELS])
+
+# output of transshipment_trips.sql
+ENCOUNTERS = dict(
+    [('gfw_trip_id', 'str'), ('lon_mean', 'float64'), ('lat_mean', 'float64'),
+     ('carrier_flag_group', 'category'), ('neighbor_flag_group', 'category'),
+     ('time_at_sea', 'category'), ('neighbor_vessel_class', 'category')] +
+    [('to_iuu_%s' % x, 'float64') for x in RISK_LEVELS] +
+    [('to_la_%s' % x, 'float64') for x in RISK_LEVELS])
+
+# output of transshipment_loitering.sql
+LOITERING = dict([('gfw_trip_id', 'str'), ('ssvid', 'str'),
+    ('lon_mean', 'float64'), ('lat_mean', 'float64')])
+
+# output of fishing_positions.sql
+POSITIONS = dict([('ssvid', 'str'), ('timestamp', 'str'),
+    ('lat', 'float64'), ('lon', 'float64'), ('fishing_hours', 'float64')])
+
+
+#-----------------------------
+# load
+#-----------------------------
+
+# read only the needed columns with explicit types; a Parquet copy next to
+# the CSV is written on the first read and reused while it is newer than the CSV
+def read_table(path, dtypes):
+    cache = os.path.splitext(path)[0] + '.parquet'
+    if pyarrow is not None and os.path.exists(cache) \
+            and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return pd.read_parquet(cache, columns=list(dtypes))
+
+    df = pd.read_csv(path, usecols=list(dtypes), dtype=dtypes)
+    df = clean_categories(df[list(dtypes)])
+
+    if pyarrow is not None:
+        df.to_parquet(cache, index=False)
+
+    return df
+
+
+# empty strings are missing values, categories in sorted order
+def clean_categories(df):
+    for col in df.columns[df.dtypes == 'category']:
+        df[col] = df[col].cat.remove_categories([x for x in df[col].cat.categories if x == ''])
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df
+
+
+# fishing trips with flag, gear, time at sea
+def load_fishing_trips(path='fishing_trips.csv'):
+    df = read_table(path, FISHING_TRIPS)
+    df = df.dropna(subset=['flag_group', 'vessel_class', 'time_at_sea'])
+    df.reset_index(inplace=True, drop=True)
+    return remove_unused_categories(df)
+
+
+# fishing trips as load_fishing_trips, chunk_size rows at a time from a CSV
+# or Parquet file; each chunk has its own categories, so compare by value
+def iter_fishing_trips(path='fishing_trips.csv', chunk_size=100000):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(chunk_size, columns=list(FISHING_TRIPS))
+        chunks = (x.to_pandas().astype(FISHING_TRIPS) for x in batches)
+    else:
+        chunks = pd.read_csv(path, usecols=list(FISHING_TRIPS), dtype=FISHING_TRIPS, chunksize=chunk_size)
+
+    for df in chunks:
+        df = clean_categories(df[list(FISHING_TRIPS)])
+        yield df.dropna(subset=['flag_group', 'vessel_class', 'time_at_sea'])
+
+
+def load_encounters(path='transshipment_trips.csv'):
+    return read_table(path, ENCOUNTERS)
+
+
+def load_loitering(path='transshipment_loitering.csv'):
+    return read_table(path, LOITERING)
+
+
+# drop categories that no longer occur after subsetting, in place
+def remove_unused_categories(df):
+    for col in df.columns[df.dtypes == 'category']:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
@@ -0,0 +1,150 @@
+import json
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from id_codes import is_known
+
+
+#-----------------------------
+# one-hot features with a fixed column layout
+#-----------------------------
+
+# learns the categories of each column once, so training and prediction
+# share the same feature layout. columns are named like pd.get_dummies
+# (<column>_<category>) and each column forms one feature group
+class OneHotEncoder:
+
+    def __init__(self, columns, groups=None):
+        self.columns = list(columns)
+        self.groups = list(columns) if groups is None else list(groups)
+
+    def fit(self, df):
+        self.categories = {}
+        for col in self.columns:
+            if hasattr(df[col], 'cat'):
+                self.categories[col] = list(df[col].cat.remove_unused_categories().cat.categories)
+            else:
+                self.categories[col] = sorted(df[col].dropna().unique())
+        return self.layout()
+
+    # feature names, group slices and the group of each feature
+    def layout(self):
+        self.feature_names = []
+        self.group_slices = {}
+        for group, col in zip(self.groups, self.columns):
+            start = len(self.feature_names)
+            self.feature_names += ['%s_%s' % (col, x) for x in self.categories[col]]
+            self.group_slices[group] = slice(start, len(self.feature_names), 1)
+
+        self.classes = []
+        for group in self.groups:
+            idx = self.group_slices[group]
+            self.classes += [group] * (idx.stop - idx.start)
+
+        return self
+
+    # sparse CSR matrix; categories unseen in fit leave their group empty
+    def transform(self, df):
+        n = len(df)
+        rows = []
+        cols = []
+        for group, col in zip(self.groups, self.columns):
+            codes = pd.Index(self.categories[col]).get_indexer(np.asarray(df[col], dtype='object'))
+            keep = codes >= 0
+            rows.append(np.arange(n)[keep])
+            cols.append(codes[keep] + self.group_slices[group].start)
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        data = np.ones(len(rows), dtype='float32')
+        return sp.csr_matrix((data, (rows, cols)), shape=(n, len(self.feature_names)))
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    # dense frame for SHAP; absent features are NaN so that they follow the
+    # same missing-value branches as the sparse matrix the model was trained on
+    def to_frame(self, x):
+        x = x.toarray().astype('float32')
+        x[x == 0] = np.nan
+        return pd.DataFrame(x, columns=self.feature_names)
+
+    # persist the fitted layout so new trip files can be encoded the same way
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'columns': self.columns, 'groups': self.groups,
+                'categories': self.categories}, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        encoder = cls(state['columns'], state['groups'])
+        encoder.categories = state['categories']
+        return encoder.layout()
+
+
+#-----------------------------
+# trip-level indicators for transshipment_analysis.py
+#-----------------------------
+
+TRANSSHIPMENT_GROUPS = ['is_tas', 'is_flag', 'with_flag', 'with_gear', 'loitering']
+
+
+# codes and sorted categories of a column
+def category_codes(x):
+    x = pd.Categorical(x).remove_unused_categories()
+    x = x.reorder_categories(sorted(x.categories))
+    return np.asarray(x.codes), list(x.categories)
+
+
+# one uint8 row per carrier trip (index gfw_trip_id, sorted), with columns in groups
+#   is_tas     time at sea of the trip, named <time_at_sea>
+#   is_flag    flag group of the carrier, named <carrier_flag_group>
+#   with_flag  flag groups of encountered fishing vessels, with_<neighbor_flag_group>
+#   with_gear  classes of encountered fishing vessels, with_<neighbor_vessel_class>
+#   loitering  loitering and no_loitering
+# encounter rows must have all four columns; indicators are the max over the
+# encounters of each trip, taken with one sparse matrix. also returns a dict of
+# group name -> column slice
+def transshipment_features(encounter, loitering):
+    trip, trip_ids = pd.factorize(encounter.gfw_trip_id, sort=True)
+    n_trips = len(trip_ids)
+    first = np.unique(trip, return_index=True)[1]
+
+    rows = []
+    cols = []
+    names = []
+    group_slices = {}
+
+    def add(group, row, codes, categories, prefix=''):
+        start = len(names)
+        rows.append(row)
+        cols.append(codes + start)
+        names.extend([prefix + x for x in categories])
+        group_slices[group] = slice(start, len(names), 1)
+
+    # trip attributes from the first encounter of each trip
+    codes, categories = category_codes(encounter.time_at_sea)
+    add('is_tas', np.arange(n_trips), codes[first], categories)
+    codes, categories = category_codes(encounter.carrier_flag_group)
+    add('is_flag', np.arange(n_trips), codes[first], categories)
+
+    # encountered fishing vessels (0: no encounter, 1: encountered)
+    codes, categories = category_codes(encounter.neighbor_flag_group)
+    add('with_flag', trip, codes, categories, 'with_')
+    codes, categories = category_codes(encounter.neighbor_vessel_class)
+    add('with_gear', trip, codes, categories, 'with_')
+
+    # loitering events of the trip
+    loitered = loitering.gfw_trip_id[np.asarray(is_known(loitering.ssvid))]
+    has_loitering = np.isin(np.asarray(trip_ids), np.asarray(loitered)).astype(int)
+    add('loitering', np.arange(n_trips), 1 - has_loitering, ['loitering', 'no_loitering'])
+
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    x = sp.csr_matrix((np.ones(len(rows), dtype='uint8'), (rows, cols)), shape=(n_trips, len(names)))
+    x.data[:] = 1
+
+    foo = pd.DataFrame(x.toarray(), index=pd.Index(trip_ids, name='gfw_trip_id'), columns=names)
+    return foo, group_slices
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------
+# events matched to their trips by sorted trip keys
+#-----------------------------
+
+# trip keys (e.g. gfw_trip_id codes) are sorted once, and the trip of each
+# event is found by binary search, without reindexing the event tables
+
+
+class SortedIndex:
+
+    def __init__(self, keys):
+        keys = np.asarray(keys)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    # position in keys of each of x, -1 where x is not a key
+    def lookup(self, x):
+        x = np.asarray(x)
+        if len(self.keys) == 0:
+            return np.full(len(x), -1)
+        i = np.minimum(np.searchsorted(self.keys, x), len(self.keys) - 1)
+        return np.where(self.keys[i] == x, self.order[i], -1)
+
+
+# columns of the events of every table with the value of their trip, one
+# frame indexed by gfw_trip_id with the tables one after the other. events
+# of trips that are not keys of index or whose value is NaN are left out
+def join_events(index, values, events, columns=('lon_mean', 'lat_mean'), name='risk_score'):
+    values = np.asarray(values)
+    parts = {x: [] for x in ['gfw_trip_id'] + list(columns) + [name]}
+    for df in events:
+        pos = index.lookup(df.gfw_trip_id)
+        value = np.where(pos >= 0, values[pos], np.nan)
+        keep = ~np.isnan(value)
+        parts['gfw_trip_id'].append(df.gfw_trip_id.to_numpy()[keep])
+        for col in columns:
+            parts[col].append(df[col].to_numpy()[keep])
+        parts[name].append(value[keep])
+
+    xy = pd.DataFrame({k: np.concatenate(v) for k, v in parts.items()})
+    return xy.set_index('gfw_trip_id')
@@ -0,0 +1,200 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from trip_data import FISHING_TRIPS
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+#-----------------------------
+# partitioned store of trips and their scores
+#-----------------------------
+
+# trips are kept in one file per month of trip_start, trips/year=YYYY/month=MM,
+# with a hash of their columns. each target keeps the model prediction of
+# every trip in files of the same months under <target>/, next to the booster,
+# the settings it was trained with and the observed trips it saw. an export
+# replaces the months it covers, so it can hold all months or only new ones
+
+
+# hash of every column of each row, the same for categorical and string columns
+def row_hash(df):
+    df = df.astype({c: str for c in df.columns if df[c].dtype.kind not in 'fiub'})
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+# 'year=YYYY/month=MM' of trip start times
+def month_partition(timestamp):
+    return pd.to_datetime(pd.Series(timestamp), utc=True).dt.strftime('year=%Y/month=%m').to_numpy()
+
+
+class TripStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = '.parquet' if pyarrow is not None else '.csv'
+        os.makedirs(path, exist_ok=True)
+
+    #-----------------------------
+    # trips
+
+    # store the months of trips and return the trips of every stored month,
+    # with row_hash and partition columns and categories as load_fishing_trips
+    def update_trips(self, trips):
+        trips = trips[list(FISHING_TRIPS)].copy()
+        trips['row_hash'] = row_hash(trips)
+        trips['partition'] = month_partition(trips.trip_start)
+
+        for key, df in trips.groupby('partition', sort=True):
+            old = self._read(self._file('trips', key), ['row_hash'])
+            if old is not None and np.array_equal(np.sort(old.row_hash.to_numpy()), np.sort(df.row_hash.to_numpy())):
+                continue
+            self._write(df.drop(columns='partition'), self._file('trips', key))
+
+        # a trip of the export whose start moved from a month outside the
+        # export is removed from that month, so the exported copy is kept
+        exported = set(trips.partition)
+        parts = []
+        for key, path in sorted(self.partitions('trips').items()):
+            df = self._read(path)
+            if key not in exported:
+                moved = df.gfw_trip_id.isin(trips.gfw_trip_id).to_numpy()
+                if moved.all():
+                    os.remove(path)
+                    continue
+                if moved.any():
+                    df = df[~moved]
+                    self._write(df, path)
+            df['partition'] = key
+            parts.append(df)
+        trips = pd.concat(parts, ignore_index=True)
+
+        for col, dtype in FISHING_TRIPS.items():
+            if dtype == 'category':
+                trips[col] = trips[col].astype('category')
+                trips[col] = trips[col].cat.reorder_categories(sorted(trips[col].cat.categories))
+        return trips
+
+    #-----------------------------
+    # model of a target
+
+    # the stored booster is kept unless there is none, it was trained with
+    # other settings (e.g. a new one-hot layout), or more than max_fraction of
+    # the observed trips it was trained on were added, removed or changed
+    def needs_training(self, target, settings, observed, max_fraction):
+        path = os.path.join(self.path, target, 'settings.json')
+        if not os.path.exists(path) or not os.path.exists(os.path.join(self.path, target, 'booster.ubj')):
+            return True
+        with open(path) as f:
+            if json.load(f) != json.loads(json.dumps(settings)):
+                print('%s: settings changed, retraining' % target)
+                return True
+
+        fraction = self.changed_fraction(target, observed)
+        print('%s: %.1f%% of observed trips changed' % (target, 100 * fraction))
+        return fraction > max_fraction
+
+    # share of the observed trips of the stored booster that were added,
+    # removed or changed; observed has gfw_trip_id and row_hash
+    def changed_fraction(self, target, observed):
+        old = self._read(os.path.join(self.path, target, 'observed' + self.ext))
+        both = old.merge(observed, on='gfw_trip_id', suffixes=('_old', '_new'))
+        modified = np.sum(both.row_hash_old.to_numpy() != both.row_hash_new.to_numpy())
+        added = len(observed) - len(both)
+        removed = len(old) - len(both)
+        return (added + removed + modified) / max(len(old), 1)
+
+    def load_booster(self, target):
+        return xgb.Booster(model_file=os.path.join(self.path, target, 'booster.ubj'))
+
+    def save_booster(self, target, bst, settings, observed):
+        folder = os.path.join(self.path, target)
+        os.makedirs(folder, exist_ok=True)
+        bst.save_model(os.path.join(folder, 'booster.tmp.ubj'))
+        os.replace(os.path.join(folder, 'booster.tmp.ubj'), os.path.join(folder, 'booster.ubj'))
+        self._write(observed[['gfw_trip_id', 'row_hash']], os.path.join(folder, 'observed' + self.ext))
+        with open(os.path.join(folder, 'settings.json'), 'w') as f:
+            json.dump(settings, f, indent=1)
+
+    #-----------------------------
+    # scores of a target
+
+    # model prediction of every trip from update_trips. trips that are new or
+    # changed since they were scored, or all with rescore, are predicted by
+    # predict(positions) and written with the rest of their months; months
+    # no longer in the store are removed
+    def update_scores(self, target, trips, predict, rescore=False):
+        stored = self.partitions(target)
+        scored = []
+        for key, path in stored.items():
+            df = self._read(path)
+            df['partition'] = key
+            scored.append(df)
+        if scored:
+            scored = pd.concat(scored, ignore_index=True)
+        else:
+            scored = pd.DataFrame({'gfw_trip_id': pd.Series([], dtype='str'),
+                'row_hash': np.array([], 'uint64'), 'pred_score': [], 'partition': pd.Series([], dtype='str')})
+
+        pos = pd.Index(scored.gfw_trip_id).get_indexer(trips.gfw_trip_id)
+        found = pos >= 0
+        score = np.full(len(trips), np.nan)
+        score[found] = scored.pred_score.to_numpy()[pos[found]]
+        stale = np.ones(len(trips), dtype='bool')
+        stale[found] = scored.row_hash.to_numpy()[pos[found]] != trips.row_hash.to_numpy()[found]
+        if rescore:
+            stale[:] = True
+        if stale.any():
+            score[stale] = predict(np.flatnonzero(stale))
+        print('%s: %d of %d trips scored' % (target, stale.sum(), len(trips)))
+
+        # months with scored trips or with trips removed since; a trip that
+        # moved to another month has changed and is scored again
+        partition = trips.partition.to_numpy()
+        n_old = scored.partition.value_counts()
+        n_new = pd.Series(partition).value_counts()
+        changed = set(partition[stale]) | set(n_new.index[n_new != n_old.reindex(n_new.index)])
+        out = pd.DataFrame({'gfw_trip_id': trips.gfw_trip_id.to_numpy(), 'row_hash': trips.row_hash.to_numpy(),
+            'pred_score': score})
+        for key in sorted(changed):
+            self._write(out[partition == key], self._file(target, key))
+        for key in set(stored) - set(n_new.index):
+            os.remove(stored[key])
+
+        return score
+
+    #-----------------------------
+    # files
+
+    # partition key -> file under name/
+    def partitions(self, name):
+        pattern = os.path.join(self.path, name, 'year=*', 'month=*' + self.ext)
+        return {os.path.relpath(x, os.path.join(self.path, name))[:-len(self.ext)].replace(os.sep, '/'): x
+            for x in glob.glob(pattern)}
+
+    def _file(self, name, key):
+        return os.path.join(self.path, name, *key.split('/')) + self.ext
+
+    def _read(self, path, columns=None):
+        if not os.path.exists(path):
+            return None
+        if self.ext == '.parquet':
+            return pd.read_parquet(path, columns=columns)
+        dtype = dict(FISHING_TRIPS, row_hash='uint64')
+        return pd.read_csv(path, usecols=columns, dtype={k: v for k, v in dtype.items() if v != 'category'})
+
+    # written first and moved into place, so a stopped run leaves whole files
+    def _write(self, df, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        if self.ext == '.parquet':
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'codes'))
+
+
+# output of fishing_trips.sql for n trips over four months of 2015, with
+# port risk votes for about half of them
+def make_fishing_trips(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 120 * 86400, n), unit='s')
+    df = pd.DataFrame({
+        'gfw_trip_id': ['trip%04d' % i for i in range(n)],
+        'ssvid': (100000000 + rng.integers(0, 50, n)).astype(str),
+        'trip_start': start.strftime('%Y-%m-%d %H:%M:%S'),
+        'flag_group': rng.choice(['china', 'group1', 'group2', 'other'], n),
+        'vessel_class': rng.choice(['trawlers', 'purse_seine', 'squid_jigger'], n),
+        'time_at_sea': rng.choice(['less_than_1m', '1_3m', '3_6m'], n),
+        'trip_end': (start + pd.Timedelta(days=10)).strftime('%Y-%m-%d %H:%M:%S')})
+    observed = rng.random(n) < 0.5
+    for target in ['iuu', 'la']:
+        for level in ['no', 'low', 'med', 'high']:
+            df['%s_%s_to' % (target, level)] = np.where(observed, rng.integers(0, 3, n), np.nan)
+    return df
+
+
+@pytest.fixture
+def fishing_trips():
+    return make_fishing_trips()
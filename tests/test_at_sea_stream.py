@@ -0,0 +1,47 @@
+import os
+import sys
+import pandas as pd
+import pytest
+import at_sea_analysis
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['at_sea_analysis.py'] + list(args))
+    at_sea_analysis.main()
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_stream_writes_every_trip(tmp_path, monkeypatch, fishing_trips, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    fishing_trips.to_csv('fishing_trips.csv', index=False)
+
+    run(monkeypatch, '--stream-chunk-size', '50', '--output-format', fmt)
+    out = pd.read_parquet('fishing_iuu.parquet') if fmt == 'parquet' else pd.read_csv('fishing_iuu.csv')
+    assert len(out) == len(fishing_trips)
+    assert not os.path.exists('fishing_iuu.%s.tmp' % fmt)
+
+
+# a failed chunk leaves neither the output nor its temporary file
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_failed_stream_leaves_no_file(tmp_path, monkeypatch, fishing_trips, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    fishing_trips.to_csv('fishing_trips.csv', index=False)
+
+    score_trips = at_sea_analysis.score_trips
+    calls = []
+
+    def fail_later(df, *args):
+        calls.append(len(df))
+        if len(calls) > 2:
+            raise RuntimeError('scoring failed')
+        return score_trips(df, *args)
+
+    monkeypatch.setattr(at_sea_analysis, 'score_trips', fail_later)
+    with pytest.raises(RuntimeError, match='scoring failed'):
+        run(monkeypatch, '--stream-chunk-size', '50', '--output-format', fmt)
+    assert not os.path.exists('fishing_iuu.%s' % fmt)
+    assert not os.path.exists('fishing_iuu.%s.tmp' % fmt)
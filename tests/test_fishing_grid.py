@@ -0,0 +1,147 @@
+import decimal
+import numpy as np
+import pandas as pd
+import pytest
+from fishing_grid import PYRAMID_LEVELS, FishingGrid, GridPyramid, TripWindows, grid_positions, load_level
+
+
+# trips of a few vessels on an hourly clock, with overlapping trips of the
+# same vessel, and positions on the same clock so that many fall exactly on
+# a trip start or end; lat and lon are often on .5 edges of the cells
+def make_trips_and_positions(seed, n_trips=60, n_positions=3000):
+    rng = np.random.default_rng(seed)
+    t0 = pd.Timestamp('2020-01-01')
+    start = rng.integers(0, 2000, n_trips)
+    trips = pd.DataFrame({
+        'ssvid': rng.choice(['1', '2', '3', '4', '5'], n_trips),
+        'trip_start': (t0 + pd.to_timedelta(start, unit='h')).strftime('%Y-%m-%d %H:%M:%S'),
+        'trip_end': (t0 + pd.to_timedelta(start + rng.integers(0, 300, n_trips), unit='h')).strftime(
+            '%Y-%m-%d %H:%M:%S'),
+        'risk_class': rng.integers(0, 3, n_trips)})
+
+    edge = rng.random(n_positions) < 0.5
+    positions = pd.DataFrame({
+        'ssvid': rng.choice(['1', '2', '3', '4', '5', '6'], n_positions),
+        'timestamp': (t0 + pd.to_timedelta(rng.integers(0, 2400, n_positions), unit='h')).strftime(
+            '%Y-%m-%d %H:%M:%S'),
+        'lat': np.where(edge, rng.integers(-20, 20, n_positions) + 0.5, rng.uniform(-80, 80, n_positions)),
+        'lon': np.where(edge, rng.integers(-20, 20, n_positions) - 0.5, rng.uniform(-179, 179, n_positions)),
+        'fishing_hours': np.where(rng.random(n_positions) < 0.1, np.nan, rng.random(n_positions))})
+    return trips, positions
+
+
+# ROUND of BigQuery, halves away from zero
+def bq_round(x):
+    return float(decimal.Decimal(repr(float(x))).quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP))
+
+
+# the join of fishing_bin_iuu.py, row by row
+def brute_force(trips, positions, bin):
+    df = positions.merge(trips, on='ssvid')
+    df = df[(df.trip_start <= df.timestamp) & (df.timestamp <= df.trip_end)].copy()
+    df['lat_bin'] = [bq_round(x / bin) * bin for x in df.lat]
+    df['lon_bin'] = [bq_round(x / bin) * bin for x in df.lon]
+    df['fishing_hours'] = df.fishing_hours.fillna(0)
+    df = df.groupby(['risk_class', 'lat_bin', 'lon_bin'], as_index=False).fishing_hours.sum()
+    return df.sort_values(['risk_class', 'lat_bin', 'lon_bin'], ignore_index=True)
+
+
+def sorted_frame(df):
+    df = df[['risk_class', 'lat_bin', 'lon_bin', 'fishing_hours']]
+    return df.sort_values(['risk_class', 'lat_bin', 'lon_bin'], ignore_index=True)
+
+
+def test_windows_has_overlapping_trips():
+    trips, _ = make_trips_and_positions(0)
+    assert TripWindows(trips.ssvid, trips.trip_start, trips.trip_end, trips.risk_class).depth > 0
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('bin', [1, 0.5])
+def test_grid_matches_row_join(seed, bin):
+    trips, positions = make_trips_and_positions(seed)
+    windows = TripWindows(trips.ssvid, trips.trip_start, trips.trip_end, trips.risk_class)
+    pos, trip = windows.match(positions.ssvid, positions.timestamp)
+    grid = FishingGrid(bin).add(positions.lat.to_numpy()[pos], positions.lon.to_numpy()[pos],
+        windows.risk_class[trip], positions.fishing_hours.fillna(0).to_numpy()[pos])
+
+    expected = brute_force(trips, positions, bin)
+    pd.testing.assert_frame_equal(sorted_frame(grid.to_frame()), expected, check_dtype=False)
+
+
+def test_grid_positions_by_chunks(tmp_path):
+    trips, positions = make_trips_and_positions(3)
+    positions.to_csv(tmp_path / 'positions.csv', index=False)
+    windows = TripWindows(trips.ssvid, trips.trip_start, trips.trip_end, trips.risk_class)
+
+    grids = grid_positions(str(tmp_path / 'positions.csv'), {'iuu': windows}, {'iuu': FishingGrid()}, 700)
+    expected = brute_force(trips, positions, 1)
+    pd.testing.assert_frame_equal(sorted_frame(grids['iuu'].to_frame()), expected, check_dtype=False)
+
+
+#-----------------------------
+# pyramid
+
+def make_points(seed, n=5000):
+    rng = np.random.default_rng(seed)
+    edge = rng.random(n) < 0.3
+    lat = np.where(edge, np.round(rng.uniform(-5, 5, n), 2), rng.uniform(-89, 89, n))
+    lon = np.where(edge, np.round(rng.uniform(-5, 5, n), 2), rng.uniform(-179, 179, n))
+    return lat, lon, rng.integers(0, 3, n), rng.random(n)
+
+
+# FLOOR(x / bin) * bin, without float error at the edges
+def floor_bin(x, bin):
+    q = (decimal.Decimal(repr(float(x))) / decimal.Decimal(repr(bin))).to_integral_value(rounding=decimal.ROUND_FLOOR)
+    return round(float(q) * bin, 10)
+
+
+@pytest.mark.parametrize('bin', PYRAMID_LEVELS)
+def test_pyramid_level_matches_floor_binning(bin):
+    lat, lon, risk_class, hours = make_points(0)
+    pyramid = GridPyramid()
+    for part in np.array_split(np.arange(len(lat)), 4):
+        pyramid.add(lat[part], lon[part], risk_class[part], hours[part])
+
+    df = pd.DataFrame({'risk_class': risk_class, 'fishing_hours': hours,
+        'lat_bin': [floor_bin(x, bin) for x in lat], 'lon_bin': [floor_bin(x, bin) for x in lon]})
+    expected = df.groupby(['risk_class', 'lat_bin', 'lon_bin'], as_index=False).fishing_hours.sum()
+    expected = expected.sort_values(['risk_class', 'lat_bin', 'lon_bin'], ignore_index=True)
+    pd.testing.assert_frame_equal(sorted_frame(pyramid.to_frame(bin)), expected, check_dtype=False)
+
+
+# small levels, so that the dense base grid stays small
+LEVELS = [3, 1, 0.5]
+
+
+def test_pyramid_levels_sum_base_cells():
+    lat, lon, risk_class, hours = make_points(1)
+    pyramid = GridPyramid(LEVELS).add(lat, lon, risk_class, hours)
+    base_hours, base_count = pyramid.level(pyramid.bin)
+    assert base_count.sum() == len(lat)
+    assert np.isclose(base_hours.sum(), hours.sum())
+
+    c, i, j = np.indices(base_hours.shape).reshape(3, -1)
+    for bin in LEVELS:
+        r = int(round(bin / pyramid.bin))
+        level_hours, level_count = pyramid.level(bin)
+        expected = np.zeros_like(level_hours)
+        np.add.at(expected, (c, i // r, j // r), base_hours.ravel())
+        np.testing.assert_allclose(level_hours, expected)
+        assert level_count.sum() == len(lat)
+        assert np.isclose(level_hours.sum(), hours.sum())
+
+
+def test_pyramid_save_and_load_level(tmp_path):
+    lat, lon, risk_class, hours = make_points(2)
+    pyramid = GridPyramid(LEVELS).add(lat, lon, risk_class, hours)
+    pyramid.save(str(tmp_path), compress=True)
+
+    saved = np.load(str(tmp_path / 'pyramid.npz'))
+    for bin in LEVELS:
+        level_hours, level_count = pyramid.level(bin)
+        mapped = load_level(str(tmp_path), bin)
+        assert isinstance(mapped, np.memmap)
+        np.testing.assert_array_equal(mapped, level_hours)
+        np.testing.assert_array_equal(load_level(str(tmp_path), bin, 'count'), level_count)
+        np.testing.assert_array_equal(saved['hours_%g' % bin], level_hours)
@@ -0,0 +1,41 @@
+import pandas as pd
+from id_codes import MISSING, IdCodes, decode_columns, encode_columns, is_known, load_ids
+
+
+def test_round_trip_across_save_and_load(tmp_path):
+    path = str(tmp_path / 'ids' / 'gfw_trip_id.csv')
+    ids = IdCodes(path)
+    codes = ids.encode(['b', 'a', None, 'b', 'NA'])
+    assert codes.dtype == 'int32'
+    assert codes.tolist() == [2, 1, MISSING, 2, 0]
+    ids.save()
+
+    # unseen ids get the next codes in sorted order, earlier codes stay
+    ids = IdCodes(path)
+    codes = ids.encode(['d', 'c', 'a', 'NA'])
+    assert codes.tolist() == [4, 3, 1, 0]
+    ids.save()
+
+    ids = IdCodes(path)
+    assert list(ids.decode([0, 1, 2, 3, 4])) == ['NA', 'a', 'b', 'c', 'd']
+    decoded = ids.decode([2, MISSING])
+    assert decoded[0] == 'b' and pd.isna(decoded[1])
+
+
+def test_is_known():
+    ids = IdCodes()
+    ids.encode(['a', 'b'])
+    codes = ids.ids.get_indexer(['a', 'unseen', 'b'])
+    assert is_known(codes).tolist() == [True, False, True]
+    assert is_known(ids.encode(['a', None])).tolist() == [True, False]
+    assert is_known(pd.Series(['a', None, 'c'])).tolist() == [True, False, True]
+
+
+def test_encode_and_decode_columns(tmp_path):
+    ids = load_ids(str(tmp_path))
+    df = pd.DataFrame({'gfw_trip_id': ['t2', 't1'], 'ssvid': ['9', None], 'x': [1.0, 2.0]})
+    encode_columns(df, ids)
+    assert df.gfw_trip_id.tolist() == [1, 0]
+    out = decode_columns(df.set_index('gfw_trip_id'), ids)
+    assert list(out.index) == ['t2', 't1'] and out.index.name == 'gfw_trip_id'
+    assert out.ssvid.iloc[0] == '9' and pd.isna(out.ssvid.iloc[1])
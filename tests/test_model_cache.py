@@ -0,0 +1,27 @@
+import os
+import numpy as np
+import xgboost as xgb
+from model_cache import ModelCache
+
+
+def test_booster_round_trip(tmp_path, capfd):
+    rng = np.random.default_rng(0)
+    x = rng.random((200, 4))
+    y = (x[:, 0] > 0.5).astype(int)
+    bst = xgb.train({'objective': 'binary:logistic'}, xgb.DMatrix(x, label=y), 5)
+
+    cache = ModelCache(str(tmp_path))
+    key = cache.model_key(x, y, {'objective': 'binary:logistic', 'nthread': 2}, 5)
+    assert cache.load_booster(key) is None
+    cache.save_booster(key, bst)
+    assert os.listdir(str(tmp_path)) == [key + '.ubj']
+
+    loaded = cache.load_booster(key)
+    np.testing.assert_array_equal(loaded.predict(xgb.DMatrix(x)), bst.predict(xgb.DMatrix(x)))
+    assert 'Unknown file format' not in capfd.readouterr().err
+
+
+def test_disabled_cache():
+    cache = ModelCache()
+    assert cache.model_key(np.zeros(3), np.zeros(3), {}, 5) is None
+    assert cache.load_booster(None) is None
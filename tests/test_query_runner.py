@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+import pytest
+from query_runner import ChunkWriter, DBAPIBackend, DuckDBBackend, SQLiteBackend, write_query
+
+pytest.importorskip('duckdb')
+
+QUERY = '''
+CREATE TEMP FUNCTION min_hours() AS (1.0);
+
+SELECT
+  ssvid,
+  SUM(fishing_hours) AS fishing_hours,
+  COUNT(*) AS n
+FROM `world-fishing-827.gfw_research.fishing`
+WHERE fishing_hours >= min_hours()
+GROUP BY ssvid
+ORDER BY ssvid
+'''
+
+
+def test_duckdb_and_sqlite_agree(tmp_path):
+    table = pd.DataFrame({'ssvid': [1, 1, 2, 2, 3], 'fishing_hours': [0.5, 2.0, 1.0, 3.5, 0.2]})
+    table.to_csv(tmp_path / 'fishing.csv', index=False)
+    tables = {'world-fishing-827.gfw_research.fishing': str(tmp_path / 'fishing.csv')}
+
+    results = []
+    for backend in [DuckDBBackend(tables=tables), SQLiteBackend(tables=tables)]:
+        path = str(tmp_path / ('%s.csv' % backend.dialect))
+        assert write_query(backend, QUERY, path, page_size=1) == 2
+        results.append(pd.read_csv(path))
+
+    expected = pd.DataFrame({'ssvid': [1, 2], 'fishing_hours': [2.0, 4.5], 'n': [1, 2]})
+    pd.testing.assert_frame_equal(results[0], expected)
+    pd.testing.assert_frame_equal(results[1], expected)
+
+
+def test_backend_needs_register():
+    with pytest.raises(TypeError):
+        DBAPIBackend(None)
+
+
+
+# the writer is kept alive, so its file has to be complete after close
+@pytest.mark.parametrize('ext', ['csv', 'parquet'])
+def test_empty_result(tmp_path, ext):
+    if ext == 'parquet':
+        pytest.importorskip('pyarrow')
+    table = pd.DataFrame({'ssvid': [1], 'fishing_hours': [0.5]})
+    table.to_csv(tmp_path / 'fishing.csv', index=False)
+    backend = DuckDBBackend(tables={'world-fishing-827.gfw_research.fishing': str(tmp_path / 'fishing.csv')})
+
+    path = str(tmp_path / ('empty.%s' % ext))
+    writer = ChunkWriter(path)
+    for page in backend.pages(QUERY):
+        writer.write(page)
+    writer.close()
+
+    assert writer.n_rows == 0
+    assert not os.path.exists(path + '.tmp')
+    if ext == 'parquet':
+        assert len(pd.read_parquet(path)) == 0
+    else:
+        assert open(path).read().strip() == ''
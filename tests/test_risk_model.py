@@ -0,0 +1,79 @@
+import json
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+import at_sea_analysis
+from risk_model import boost, train_model
+
+PARAMS = {'eta': 0.3, 'max_depth': 3, 'nthread': 1}
+
+
+def make_data(seed=0, n=400):
+    rng = np.random.default_rng(seed)
+    x = pd.DataFrame(rng.random((n, 5)), columns=['f%d' % i for i in range(5)])
+    y = x.f0 * 2 + np.sin(6 * x.f1) + rng.normal(0, 0.5, n)
+    return x, y.to_numpy()
+
+
+def test_boost_matches_early_stopping():
+    x, y = make_data()
+    dtrain = xgb.DMatrix(x.iloc[:300], label=y[:300])
+    dvalid = xgb.DMatrix(x.iloc[300:], label=y[300:])
+    evals = [(dtrain, 'train'), (dvalid, 'valid')]
+
+    result = {}
+    expected = xgb.train(PARAMS, dtrain, 200, evals=evals, early_stopping_rounds=5, evals_result=result,
+        verbose_eval=False)
+    bst, history, best_iteration = boost(PARAMS, dtrain, 200, evals, early_stopping_rounds=5)
+
+    assert best_iteration == expected.best_iteration
+    assert len(history) == len(result['valid']['rmse']) < 200
+    np.testing.assert_allclose(history['valid-rmse'], result['valid']['rmse'], rtol=1e-5)
+    np.testing.assert_array_equal(bst.predict(dvalid), expected.predict(dvalid))
+
+
+def test_train_model_refits_on_all_rows():
+    x, y = make_data(1)
+    bst, history, summary = train_model(PARAMS, x, y, 200, valid_fraction=0.25, early_stopping_rounds=5)
+
+    # the same split and early stopping with xgb.train
+    valid = np.random.RandomState(0).rand(len(y)) < 0.25
+    dtrain = xgb.DMatrix(x[~valid], label=y[~valid])
+    dvalid = xgb.DMatrix(x[valid], label=y[valid])
+    stopped = xgb.train(PARAMS, dtrain, 200, evals=[(dtrain, 'train'), (dvalid, 'valid')],
+        early_stopping_rounds=5, verbose_eval=False)
+    assert summary['best_iteration'] == stopped.best_iteration
+    assert summary['n_trees'] == stopped.best_iteration + 1
+    assert summary['rounds_evaluated'] == len(history)
+    assert summary['best_valid-rmse'] == pytest.approx(stopped.best_score, rel=1e-5)
+
+    dall = xgb.DMatrix(x, label=y)
+    refit = xgb.train(PARAMS, dall, stopped.best_iteration + 1)
+    assert bst.num_boosted_rounds() == stopped.best_iteration + 1
+    np.testing.assert_array_equal(bst.predict(dall), refit.predict(dall))
+
+
+def test_train_model_without_validation():
+    x, y = make_data(2)
+    bst, history, summary = train_model(PARAMS, x, y, 20)
+    assert summary['n_trees'] == bst.num_boosted_rounds() == len(history) == 20
+    dall = xgb.DMatrix(x, label=y)
+    np.testing.assert_array_equal(bst.predict(dall), xgb.train(PARAMS, dall, 20).predict(dall))
+
+
+def test_history_next_to_predictions(tmp_path, monkeypatch, fishing_trips):
+    monkeypatch.chdir(tmp_path)
+    fishing_trips.to_csv('fishing_trips.csv', index=False)
+    monkeypatch.setattr(sys, 'argv', ['at_sea_analysis.py', '--valid-fraction', '0.2',
+        '--early-stopping-rounds', '5'])
+    at_sea_analysis.main()
+
+    history = pd.read_csv('fishing_iuu_train.csv')
+    with open('fishing_iuu_train.json') as f:
+        summary = json.load(f)
+    assert summary['rounds_evaluated'] == len(history)
+    assert summary['n_trees'] == summary['best_iteration'] + 1
+    assert history['valid-rmse'].idxmin() == summary['best_iteration']
+    assert (tmp_path / 'fishing_iuu_pred.csv').exists()
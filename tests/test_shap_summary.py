@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+import shap_summary
+from shap_summary import chunked_group_importance
+
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.integers(0, 2, (200, 6)).astype('float32'), columns=['f%d' % i for i in range(6)])
+    y = x.to_numpy() @ rng.normal(size=6) + rng.normal(size=200) * 0.1
+    bst = xgb.train({'max_depth': 3, 'nthread': 1}, xgb.DMatrix(x, label=y), 10)
+    return bst, x
+
+
+GROUPINGS = [([slice(0, 2), slice(2, 4), slice(4, 6)], ['a', 'b', 'c'])]
+
+
+# pool running in threads that records the start method and the number of
+# shards submitted and not yet done
+class RecordingPool(ThreadPoolExecutor):
+
+    def __init__(self, max_workers, mp_context, initializer, initargs):
+        super().__init__(max_workers, initializer=initializer, initargs=initargs)
+        RecordingPool.method = mp_context.get_start_method()
+        RecordingPool.in_flight = 0
+        RecordingPool.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self.lock:
+            RecordingPool.in_flight += 1
+            RecordingPool.max_in_flight = max(RecordingPool.max_in_flight, RecordingPool.in_flight)
+        job = super().submit(fn, *args)
+        job.add_done_callback(self.done)
+        return job
+
+    def done(self, job):
+        with self.lock:
+            RecordingPool.in_flight -= 1
+
+
+def test_parallel_matches_serial(model, tmp_path):
+    bst, x = model
+    serial, = chunked_group_importance(bst, x, GROUPINGS, chunk_size=30)
+    parallel, = chunked_group_importance(bst, x, GROUPINGS, chunk_size=30, workers=2,
+        spill=str(tmp_path / 'raw.npy'))
+    np.testing.assert_allclose(parallel.values, serial.values, atol=1e-6)
+    raw = np.load(str(tmp_path / 'raw.npy'))
+    assert raw.shape == (200, 6, 6)
+
+
+def test_pool_keeps_a_window_of_shards(model, monkeypatch):
+    bst, x = model
+    monkeypatch.setattr(shap_summary, 'ProcessPoolExecutor', RecordingPool)
+    serial, = chunked_group_importance(bst, x, GROUPINGS, chunk_size=10)
+    parallel, = chunked_group_importance(bst, x, GROUPINGS, chunk_size=10, workers=2)
+    np.testing.assert_allclose(parallel.values, serial.values, atol=1e-6)
+    assert RecordingPool.method in ('forkserver', 'spawn')
+    assert RecordingPool.max_in_flight <= 4
+
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from trip_features import OneHotEncoder
+
+COLUMNS = ['flag_group', 'vessel_class', 'time_at_sea']
+GROUPS = ['flag', 'gear', 'tas']
+
+
+def test_fit_transform_matches_get_dummies(fishing_trips):
+    df = fishing_trips[COLUMNS]
+    encoder = OneHotEncoder(COLUMNS, GROUPS)
+    x = encoder.fit_transform(df)
+
+    expected = pd.get_dummies(df, dtype='float32')
+    assert encoder.feature_names == list(expected.columns)
+    np.testing.assert_array_equal(x.toarray(), expected.to_numpy())
+
+    # each group spans the columns of its column, in order
+    assert encoder.group_slices['flag'] == slice(0, 4, 1)
+    assert encoder.group_slices['gear'] == slice(4, 7, 1)
+    assert encoder.group_slices['tas'] == slice(7, 10, 1)
+    assert encoder.classes == ['flag'] * 4 + ['gear'] * 3 + ['tas'] * 3
+
+
+def test_categories_of_fit_only(fishing_trips):
+    df = fishing_trips[COLUMNS].astype('category')
+    encoder = OneHotEncoder(COLUMNS, GROUPS).fit(df[df.vessel_class != 'squid_jigger'])
+    assert 'vessel_class_squid_jigger' not in encoder.feature_names
+
+    # unseen and missing categories leave their group empty
+    new = pd.DataFrame({'flag_group': ['china', 'unknown', None], 'vessel_class': ['squid_jigger', 'trawlers', None],
+        'time_at_sea': ['1_3m', '1_3m', None]})
+    x = encoder.transform(new).toarray()
+    for group in GROUPS:
+        block = x[:, encoder.group_slices[group]]
+        assert ((block == 0) | (block == 1)).all() and (block.sum(axis=1) <= 1).all()
+    assert x[:, encoder.group_slices['flag']].sum(axis=1).tolist() == [1, 0, 0]
+    assert x[:, encoder.group_slices['gear']].sum(axis=1).tolist() == [0, 1, 0]
+    assert x[2].sum() == 0
+
+
+def test_save_and_load(tmp_path, fishing_trips):
+    encoder = OneHotEncoder(COLUMNS, GROUPS).fit(fishing_trips)
+    encoder.save(str(tmp_path / 'encoder.json'))
+    loaded = OneHotEncoder.load(str(tmp_path / 'encoder.json'))
+
+    assert loaded.feature_names == encoder.feature_names
+    assert loaded.group_slices == encoder.group_slices
+    assert loaded.classes == encoder.classes
+    np.testing.assert_array_equal(loaded.transform(fishing_trips).toarray(),
+        encoder.transform(fishing_trips).toarray())
+
+
+def test_to_frame_has_nan_for_absent_features(fishing_trips):
+    encoder = OneHotEncoder(COLUMNS, GROUPS).fit(fishing_trips)
+    x = encoder.transform(fishing_trips.iloc[:5])
+    df = encoder.to_frame(x)
+
+    assert list(df.columns) == encoder.feature_names
+    assert (df.dtypes == 'float32').all()
+    np.testing.assert_array_equal(df.isnull().to_numpy(), x.toarray() == 0)
+    assert (df.to_numpy()[x.toarray() == 1] == 1).all()
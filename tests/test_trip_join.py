@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+from trip_join import SortedIndex, join_events
+
+
+def test_lookup():
+    index = SortedIndex([30, 10, 20])
+    assert index.lookup([20, 30, 10, 15, 99, -1]).tolist() == [2, 0, 1, -1, -1, -1]
+    assert SortedIndex([]).lookup([1, 2]).tolist() == [-1, -1]
+
+
+def test_join_events_leaves_out_missing_trips():
+    index = SortedIndex(np.array([7, 3, 5]))
+    score = np.array([0.7, 0.3, np.nan])
+    encounter = pd.DataFrame({'gfw_trip_id': [3, 4, 7, 5], 'lon_mean': [1.0, 2.0, 3.0, 4.0],
+        'lat_mean': [10.0, 20.0, 30.0, 40.0], 'other': 0})
+    loitering = pd.DataFrame({'gfw_trip_id': [7, 9], 'lon_mean': [5.0, 6.0], 'lat_mean': [50.0, 60.0]})
+
+    xy = join_events(index, score, [encounter, loitering])
+
+    # trip 4 and 9 are not in the index and trip 5 has no score
+    expected = pd.DataFrame({'lon_mean': [1.0, 3.0, 5.0], 'lat_mean': [10.0, 30.0, 50.0],
+        'risk_score': [0.3, 0.7, 0.7]}, index=pd.Index([3, 7, 7], name='gfw_trip_id'))
+    pd.testing.assert_frame_equal(xy, expected)
@@ -0,0 +1,148 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+import trip_store
+from trip_store import TripStore
+
+
+@pytest.fixture(params=['parquet', 'csv'])
+def store(request, tmp_path, monkeypatch):
+    if request.param == 'csv':
+        monkeypatch.setattr(trip_store, 'pyarrow', None)
+    store = TripStore(str(tmp_path / 'store'))
+    assert store.ext == '.' + request.param
+    return store
+
+
+# records the files written by the store
+@pytest.fixture
+def written(store, monkeypatch):
+    paths = []
+    write = store._write
+
+    def record(df, path):
+        paths.append(os.path.relpath(path, store.path))
+        write(df, path)
+
+    monkeypatch.setattr(store, '_write', record)
+    return paths
+
+
+def month(trips, key):
+    return trips[trips.trip_start.str.startswith(key)]
+
+
+def test_update_trips_skips_unchanged_months(store, written, fishing_trips):
+    trips = store.update_trips(fishing_trips)
+    assert len(written) == 4
+    assert sorted(trips.gfw_trip_id) == sorted(fishing_trips.gfw_trip_id)
+    assert trips.vessel_class.dtype == 'category'
+
+    # same export, then one changed trip in March
+    written.clear()
+    store.update_trips(fishing_trips)
+    assert written == []
+
+    changed = fishing_trips.copy()
+    changed.loc[month(changed, '2015-03').index[0], 'flag_group'] = 'other2'
+    store.update_trips(changed)
+    assert written == [os.path.join('trips', 'year=2015', 'month=03' + store.ext)]
+
+
+def test_trip_moved_to_a_later_month(store, fishing_trips):
+    store.update_trips(fishing_trips)
+
+    # an export of April only, with a January trip now starting in April
+    moved = month(fishing_trips, '2015-01').iloc[[0]].copy()
+    moved['trip_start'] = '2015-04-15 00:00:00'
+    april = pd.concat([month(fishing_trips, '2015-04'), moved])
+    trips = store.update_trips(april)
+
+    assert trips.gfw_trip_id.is_unique
+    assert len(trips) == len(fishing_trips)
+    row = trips[trips.gfw_trip_id == moved.gfw_trip_id.iloc[0]]
+    assert row.partition.iloc[0] == 'year=2015/month=04'
+
+
+def test_trip_moved_to_an_earlier_month(store, fishing_trips):
+    store.update_trips(fishing_trips)
+
+    # an export of January only, with an April trip now starting in January
+    moved = month(fishing_trips, '2015-04').iloc[[0]].copy()
+    moved['trip_start'] = '2015-01-15 00:00:00'
+    moved['flag_group'] = 'other2'
+    january = pd.concat([month(fishing_trips, '2015-01'), moved])
+
+    # the exported copy is kept, also by a later export of other months
+    for trips in [store.update_trips(january), store.update_trips(month(fishing_trips, '2015-02'))]:
+        assert trips.gfw_trip_id.is_unique
+        assert len(trips) == len(fishing_trips)
+        row = trips[trips.gfw_trip_id == moved.gfw_trip_id.iloc[0]]
+        assert row.partition.iloc[0] == 'year=2015/month=01'
+        assert row.flag_group.iloc[0] == 'other2'
+    april = store._read(store.partitions('trips')['year=2015/month=04'])
+    assert len(april) == len(month(fishing_trips, '2015-04')) - 1
+
+
+def test_changed_fraction(store, fishing_trips):
+    trips = store.update_trips(fishing_trips)
+    observed = trips[['gfw_trip_id', 'row_hash']].iloc[:100].reset_index(drop=True)
+    bst = xgb.train({}, xgb.DMatrix(np.zeros((2, 1)), label=[0, 1]), 1)
+    store.save_booster('iuu', bst, {'n_trees': 1}, observed)
+    assert store.changed_fraction('iuu', observed) == 0
+
+    # 5 added, 3 removed, 2 modified of 100
+    added = trips[['gfw_trip_id', 'row_hash']].iloc[100:105]
+    now = pd.concat([observed.iloc[3:], added], ignore_index=True)
+    now.loc[[0, 1], 'row_hash'] += np.uint64(1)
+    assert store.changed_fraction('iuu', now) == pytest.approx(0.1)
+
+    assert not store.needs_training('iuu', {'n_trees': 1}, now, 0.2)
+    assert store.needs_training('iuu', {'n_trees': 1}, now, 0.05)
+    assert store.needs_training('iuu', {'n_trees': 2}, observed, 0.2)
+
+
+def test_update_scores_only_stale_trips(store, fishing_trips):
+    calls = []
+
+    def predict(idx):
+        calls.append(len(idx))
+        return np.asarray(idx, dtype='float64')
+
+    trips = store.update_trips(fishing_trips)
+    score = store.update_scores('iuu', trips, predict)
+    assert calls == [len(trips)]
+    np.testing.assert_array_equal(score, np.arange(len(trips)))
+
+    # nothing changed
+    assert (store.update_scores('iuu', trips, predict) == score).all()
+    assert calls == [len(trips)]
+
+    # one changed trip is scored, the rest is read back
+    trips.loc[5, 'row_hash'] += np.uint64(1)
+    score = store.update_scores('iuu', trips, lambda idx: np.full(len(idx), -1.0))
+    assert (score == -1).sum() == 1 and score[5] == -1
+    assert np.delete(score, 5).tolist() == np.delete(np.arange(len(trips)), 5).tolist()
+
+    # rescore predicts every trip
+    calls.clear()
+    store.update_scores('iuu', trips, predict, rescore=True)
+    assert calls == [len(trips)]
+
+
+def test_update_scores_removes_dropped_months(store, fishing_trips):
+    trips = store.update_trips(fishing_trips)
+    store.update_scores('iuu', trips, lambda idx: np.zeros(len(idx)))
+    assert len(store.partitions('iuu')) == 4
+
+    # January gone, a February trip removed
+    kept = trips[trips.partition != 'year=2015/month=01']
+    kept = kept.drop(kept.index[kept.partition == 'year=2015/month=02'][0]).reset_index(drop=True)
+    calls = []
+    store.update_scores('iuu', kept, lambda idx: calls.append(len(idx)) or np.zeros(len(idx)))
+    assert calls == []
+    assert sorted(store.partitions('iuu')) == ['year=2015/month=02', 'year=2015/month=03', 'year=2015/month=04']
+    february = store._read(store.partitions('iuu')['year=2015/month=02'])
+    assert len(february) == (kept.partition == 'year=2015/month=02').sum()